@@ -0,0 +1,704 @@
+# coding=utf-8
+
+import argparse
+import concurrent.futures
+import copy
+import os
+import pandas as pd
+import random
+import tempfile
+import time
+import torch
+import torch.multiprocessing as mp
+import torch.nn as nn
+
+from model.attention.utils import compute_attention_matrix
+from model.attention.utils import compute_attention_matrix_loop
+from model.attention.utils import cosine
+from model.attention.utils import euclidean
+from model.attention.utils import manhattan
+from model.attention.utils import mask_attention_matrix
+from model.embeddings.quantized import QuantizedEmbedding
+from model.utils import sequence_mask
+from setup import remove_stop_words
+from setup import tokenize_datasets
+from setup import setup_model
+from setup import text_to_word_list
+from tokenizer import Tokenizer
+from trainer.distributed import all_gather
+from trainer.distributed import init_distributed
+from trainer.multiclass_classifier_trainer import MulticlassClassifierTrainer
+from torch.utils.data import DataLoader
+from torch.utils.data import TensorDataset
+from trainer.loaders import TensorBatchLoader
+from utils import autocast_inference
+from utils import validate_autocast_inference
+
+MATCH_SCORES = {
+    "cosine": cosine,
+    "euclidean": euclidean,
+    "manhattan": manhattan
+}
+
+def time_fn(fn, *args, repeats=10):
+    """ Measures the average wall-clock time of a function call.
+
+        Args:
+            fn: function
+                The function to time.
+            args: list
+                The arguments to pass to the function.
+            repeats: int
+                The number of timed calls to average over.
+
+        Returns:
+            seconds: float
+                The average number of seconds per call.
+    """
+    fn(*args) # warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(*args)
+    return (time.perf_counter() - start) / repeats
+
+
+def check_attention(args):
+    """ Checks that the batched attention-matrix computation agrees with the
+        reference loop for every match-score and shape, both on full inputs
+        and on padded inputs masked with random lengths (including empty
+        sequences).
+
+        Args:
+            args: argparse.Namespace
+                The parsed command line arguments.
+
+        Returns:
+            None
+    """
+    generator = torch.Generator().manual_seed(0)
+    for name, match_score in MATCH_SCORES.items():
+        for batch_size in args.batch_sizes:
+            for max_length in args.lengths:
+                x1, x2 = torch.randn(2, batch_size, 1, max_length, args.input_size, generator=generator)
+                lengths1, lengths2 = torch.randint(0, max_length + 1, (2, batch_size), generator=generator)
+                for lengths in [(None, None), (lengths1, lengths2)]:
+                    inputs = [
+                        x if length is None else x.masked_fill(~sequence_mask(length, max_length)[:, None, :, None], 0)
+                        for x, length in zip((x1, x2), lengths)
+                    ]
+                    A = mask_attention_matrix(compute_attention_matrix(*inputs, match_score), *lengths)
+                    A_loop = mask_attention_matrix(compute_attention_matrix_loop(*inputs, match_score), *lengths)
+                    assert torch.allclose(A, A_loop, atol=1e-5), \
+                        "{} differs for batch {}, length {}, masked {}".format(
+                            name, batch_size, max_length, lengths[0] is not None)
+    print("Batched attention matrices match the reference loop")
+
+
+def benchmark_attention(args):
+    """ Compares the batched attention-matrix computation against the
+        reference loop for every match-score, checking that both agree
+        (see check_attention) before timing them.
+
+        Args:
+            args: argparse.Namespace
+                The parsed command line arguments.
+
+        Returns:
+            None
+    """
+    torch.set_grad_enabled(False)
+    check_attention(args)
+    if args.check_only:
+        return
+    print("{:>10} {:>6} {:>6} {:>12} {:>12} {:>8}".format(
+        "score", "batch", "length", "loop (ms)", "batched (ms)", "speedup"))
+    for name, match_score in MATCH_SCORES.items():
+        for batch_size in args.batch_sizes:
+            for max_length in args.lengths:
+                x1 = torch.randn(batch_size, 1, max_length, args.input_size)
+                x2 = torch.randn(batch_size, 1, max_length, args.input_size)
+                loop = time_fn(compute_attention_matrix_loop, x1, x2, match_score,
+                    repeats=args.repeats)
+                batched = time_fn(compute_attention_matrix, x1, x2, match_score,
+                    repeats=args.repeats)
+                print("{:>10} {:>6} {:>6} {:>12.3f} {:>12.3f} {:>7.1f}x".format(
+                    name, batch_size, max_length, 1000 * loop, 1000 * batched,
+                    loop / batched))
+
+
+def train_step(model, *inputs):
+    """ Computes the forward and backward passes of the model on a batch.
+
+        Args:
+            model: Model
+                The model to train.
+            inputs: list of torch.Tensors
+                The inputs to the model.
+
+        Returns:
+            None
+    """
+    model.zero_grad()
+    model(*inputs).sum().backward()
+
+
+def make_model(args, block_type, checkpoint_activations=None):
+    """ Creates a randomly initialized model whose layers all use the given
+        block type.
+
+        Args:
+            args: argparse.Namespace
+                The parsed command line arguments.
+            block_type: string
+                The type of block to use in every layer.
+            checkpoint_activations: string
+                Optional, the activation checkpointing mode of the model.
+
+        Returns:
+            model: Model
+                The instantiated model.
+    """
+    input_sizes = [args.input_size] + [args.output_size] * (args.num_layers - 1)
+    config = {
+        "embeddings": {"size": args.input_size},
+        "max_length": args.max_length,
+        "use_all_layer_outputs": True,
+        "layers": [
+            [{
+                "type": block_type,
+                "input_size": input_size,
+                "output_size": args.output_size,
+                "width": args.width,
+                "match_score": "manhattan",
+                "share_weights": True,
+                "dropout_rate": 0
+            }]
+            for input_size in input_sizes
+        ],
+        "checkpoint_activations": checkpoint_activations
+    }
+    embeddings = nn.Embedding(args.vocab_size, args.input_size)
+    return setup_model(config, embeddings)
+
+
+def set_batch_pairs(model, batch_pairs):
+    """ Turns siamese branch batching on or off for every module of the model.
+
+        Args:
+            model: Model
+                The model to update.
+            batch_pairs: boolean
+                Specifies whether to stack both sides of each pair.
+
+        Returns:
+            None
+    """
+    for module in model.modules():
+        if hasattr(module, "batch_pairs"):
+            module.batch_pairs = batch_pairs
+
+
+def benchmark_siamese(args):
+    """ Compares the training throughput of each block type with and without
+        siamese branch batching, checking that both modes produce the same
+        outputs before timing them.
+
+        Args:
+            args: argparse.Namespace
+                The parsed command line arguments.
+
+        Returns:
+            None
+    """
+    block_types = ["bcnn", "abcnn1", "abcnn2", "abcnn3"]
+    models = [make_model(args, block_type) for block_type in block_types]
+    inputs = torch.randint(args.vocab_size, (args.batch_size, 2, args.max_length))
+    print("{:>8} {:>16} {:>16} {:>8}".format(
+        "block", "separate (ex/s)", "batched (ex/s)", "speedup"))
+    for block_type, model in zip(block_types, models):
+        set_batch_pairs(model, False)
+        outputs = model(inputs)
+        separate = time_fn(train_step, model, inputs, repeats=args.repeats)
+        set_batch_pairs(model, True)
+        assert(torch.allclose(model(inputs), outputs, atol=1e-5))
+        batched = time_fn(train_step, model, inputs, repeats=args.repeats)
+        print("{:>8} {:>16.1f} {:>16.1f} {:>7.2f}x".format(
+            block_type, args.batch_size / separate, args.batch_size / batched,
+            separate / batched))
+
+
+def benchmark_precision(args):
+    """ Compares fp32 inference against reduced-precision autocast inference
+        on the CPU for each block type, reporting how far the scores drift.
+
+        Args:
+            args: argparse.Namespace
+                The parsed command line arguments.
+
+        Returns:
+            None
+    """
+    def fp32_inference(model, inputs, lengths):
+        with torch.no_grad():
+            return model(inputs, lengths)
+
+    dtype = getattr(torch, args.dtype)
+    block_types = ["bcnn", "abcnn1", "abcnn2", "abcnn3"]
+    models = [make_model(args, block_type).eval() for block_type in block_types]
+    inputs = torch.randint(1, args.vocab_size, (args.batch_size, 2, args.max_length))
+    lengths = torch.randint(1, args.max_length + 1, (args.batch_size, 2))
+    print("{:>8} {:>12} {:>12} {:>8} {:>10} {:>10}".format(
+        "block", "fp32 (ex/s)", "{} (ex/s)".format(args.dtype), "speedup",
+        "max error", "agreement"))
+    for block_type, model in zip(block_types, models):
+        max_error, agreement = \
+            validate_autocast_inference(model, inputs, lengths, dtype=dtype)
+        fp32 = time_fn(fp32_inference, model, inputs, lengths, repeats=args.repeats)
+        reduced = time_fn(autocast_inference, model, inputs, lengths, dtype,
+            repeats=args.repeats)
+        print("{:>8} {:>12.1f} {:>12.1f} {:>7.2f}x {:>10.2e} {:>10.3f}".format(
+            block_type, args.batch_size / fp32, args.batch_size / reduced,
+            fp32 / reduced, max_error, agreement))
+
+
+def tensor_megabytes(tensors):
+    """ Computes the total size of a collection of tensors.
+
+        Args:
+            tensors: iterable of torch.Tensors
+                The tensors to measure.
+
+        Returns:
+            megabytes: float
+                Their total size.
+    """
+    return sum(tensor.nelement() * tensor.element_size() for tensor in tensors) / 2 ** 20
+
+
+def benchmark_quantization(args):
+    """ Compares inference with the fp32 embedding matrix against inference
+        with the int8 QuantizedEmbedding for each block type, reporting the
+        memory of both matrices and how far the scores drift.
+
+        Args:
+            args: argparse.Namespace
+                The parsed command line arguments.
+
+        Returns:
+            None
+    """
+    def inference(model, inputs, lengths):
+        with torch.no_grad():
+            return model(inputs, lengths)
+
+    block_types = ["bcnn", "abcnn1", "abcnn2", "abcnn3"]
+    inputs = torch.randint(1, args.vocab_size, (args.batch_size, 2, args.max_length))
+    lengths = torch.randint(1, args.max_length + 1, (args.batch_size, 2))
+    print("{:>8} {:>12} {:>12} {:>10} {:>10} {:>10} {:>10}".format(
+        "block", "fp32 (ex/s)", "int8 (ex/s)", "fp32 (MB)", "int8 (MB)",
+        "max error", "agreement"))
+    for block_type in block_types:
+        model = make_model(args, block_type).eval()
+        quantized = copy.deepcopy(model)
+        quantized.embeddings = QuantizedEmbedding.from_float(model.embeddings)
+        expected = inference(model, inputs, lengths)
+        actual = inference(quantized, inputs, lengths)
+        max_error = torch.max(torch.abs(actual - expected)).item()
+        agreement = torch.mean(
+            (torch.argmax(actual, dim=1) == torch.argmax(expected, dim=1)).float()
+        ).item()
+        fp32 = time_fn(inference, model, inputs, lengths, repeats=args.repeats)
+        int8 = time_fn(inference, quantized, inputs, lengths, repeats=args.repeats)
+        print("{:>8} {:>12.1f} {:>12.1f} {:>10.1f} {:>10.1f} {:>10.2e} {:>10.3f}".format(
+            block_type, args.batch_size / fp32, args.batch_size / int8,
+            tensor_megabytes(model.embeddings.parameters()),
+            tensor_megabytes(quantized.embeddings.buffers()), max_error, agreement))
+
+
+def saved_activation_memory(model, *inputs):
+    """ Measures the memory held by the tensors that a forward pass of the
+        model saves for its backward pass.
+
+        Args:
+            model: Model
+                The model to measure.
+            inputs: list of torch.Tensors
+                The inputs to the model.
+
+        Returns:
+            megabytes: float
+                The total size of the distinct storages saved for backward.
+    """
+    storages = {}
+    def pack(tensor):
+        storage = tensor.untyped_storage()
+        storages[storage.data_ptr()] = storage.nbytes()
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        model(*inputs)
+    return sum(storages.values()) / 2 ** 20
+
+
+def benchmark_checkpointing(args):
+    """ Compares the training throughput and the memory saved for backward
+        of an ABCNN-3 model without activation checkpointing and with
+        per-layer and per-block checkpointing.
+
+        Args:
+            args: argparse.Namespace
+                The parsed command line arguments.
+
+        Returns:
+            None
+    """
+    modes = [None, "layer", "block"]
+    models = [make_model(args, "abcnn3", checkpoint_activations=mode) for mode in modes]
+    inputs = torch.randint(args.vocab_size, (args.batch_size, 2, args.max_length))
+    print("{:>8} {:>10} {:>16} {:>10} {:>10}".format(
+        "mode", "ex/s", "activations (MB)", "throughput", "memory"))
+    base_seconds = base_memory = None
+    for mode, model in zip(modes, models):
+        memory = saved_activation_memory(model, inputs)
+        seconds = time_fn(train_step, model, inputs, repeats=args.repeats)
+        base_seconds = base_seconds or seconds
+        base_memory = base_memory or memory
+        print("{:>8} {:>10.1f} {:>16.1f} {:>9.0%} {:>9.0%}".format(
+            mode or "none", args.batch_size / seconds, memory,
+            base_seconds / seconds, memory / base_memory))
+
+
+def sample_questions(num_questions, seed=0):
+    """ Generates random questions that exercise every rule of the tokenizer.
+
+        Args:
+            num_questions: int
+                The number of questions to generate.
+            seed: int
+                The seed for the random number generator.
+
+        Returns:
+            questions: list of string
+                The generated questions.
+    """
+    words = [
+        "What's", "how", "do", "I", "can't", "don't", "I'm", "you're", "we've",
+        "he'd", "they'll", "it's", "reset", "my", "password", "e-mail", "U.S.",
+        "e.g.", "9/11", "5k", "VPN", "access", "to", "the", "laptop!", "a+b=c",
+        "2^10", "time:", "j k", "(urgent)", "why?", "über", "#tag", "and,", "or."
+    ]
+    rng = random.Random(seed)
+    return [" ".join(rng.choices(words, k=rng.randint(3, 30))) for _ in range(num_questions)]
+
+
+def benchmark_tokenizer(args):
+    """ Compares the throughput of the reference re.sub chain in setup.py
+        against the compiled Tokenizer, one text at a time and column-wise,
+        checking that all of them produce the same words before timing them.
+
+        Args:
+            args: argparse.Namespace
+                The parsed command line arguments.
+
+        Returns:
+            None
+    """
+    if args.data_path:
+        dataset = pd.read_csv(args.data_path)
+        questions = dataset["question1"].tolist() + dataset["question2"].tolist()
+    else:
+        questions = sample_questions(args.num_questions)
+    tokenizer = Tokenizer()
+
+    def reference(texts):
+        return [remove_stop_words(text_to_word_list(text)) for text in texts]
+
+    def single(texts):
+        return [tokenizer(text) for text in texts]
+
+    expected = reference(questions)
+    assert single(questions) == expected
+    assert tokenizer.tokenize_column(questions) == expected
+
+    print("{:>10} {:>12} {:>8}".format("mode", "texts/s", "speedup"))
+    base_seconds = None
+    for mode, fn in [("reference", reference), ("single", single), ("column", tokenizer.tokenize_column)]:
+        seconds = time_fn(fn, questions, repeats=args.repeats)
+        base_seconds = base_seconds or seconds
+        print("{:>10} {:>12.0f} {:>7.1f}x".format(mode, len(questions) / seconds, base_seconds / seconds))
+
+
+def benchmark_preprocessing(args):
+    """ Compares the dataset setup time with different numbers of worker
+        processes on random question pairs, checking that every run produces
+        the same examples and vocabulary as the first one.
+
+        Args:
+            args: argparse.Namespace
+                The parsed command line arguments.
+
+        Returns:
+            None
+    """
+    rng = random.Random(0)
+    questions = sample_questions(args.num_pairs // 2)
+    with tempfile.TemporaryDirectory() as directory:
+        data_paths = {}
+        for name in ["train", "val", "test"]:
+            data_paths[name] = os.path.join(directory, "{}.csv".format(name))
+            pd.DataFrame({
+                "question1": rng.choices(questions, k=args.num_pairs),
+                "question2": rng.choices(questions, k=args.num_pairs),
+                "is_duplicate": rng.choices([0, 1], k=args.num_pairs)
+            }).to_csv(data_paths[name], index=False)
+
+        results = []
+        for num_workers in args.workers:
+            config = {
+                "max_length": args.max_length,
+                "data_paths": data_paths,
+                "preprocessing_workers": num_workers
+            }
+            start = time.perf_counter()
+            results.append(tokenize_datasets(config))
+            results[-1] += (time.perf_counter() - start,)
+
+    print("{:>8} {:>10} {:>10} {:>8}".format("workers", "seconds", "pairs/s", "speedup"))
+    expected = results[0]
+    for num_workers, (examples, lengths, labels, word2index, seconds) in zip(args.workers, results):
+        assert word2index == expected[3]
+        assert all(torch.equal(examples[name], expected[0][name]) for name in examples)
+        assert all(torch.equal(lengths[name], expected[1][name]) for name in lengths)
+        print("{:>8} {:>10.2f} {:>10.0f} {:>7.1f}x".format(
+            num_workers, seconds, 3 * args.num_pairs / seconds, expected[4] / seconds))
+
+
+def benchmark_loader(args):
+    """ Compares the time to iterate over one epoch of a resident tensor
+        dataset with a DataLoader against a TensorBatchLoader, checking that
+        both yield the same batches in order before timing them shuffled.
+
+        Args:
+            args: argparse.Namespace
+                The parsed command line arguments.
+
+        Returns:
+            None
+    """
+    def epoch(loader):
+        for batch in loader:
+            pass
+
+    features = torch.randint(1, 30000, (args.num_examples, 2, args.max_length), dtype=torch.int16)
+    lengths = torch.randint(1, args.max_length + 1, (args.num_examples, 2), dtype=torch.uint8)
+    labels = torch.randint(0, 2, (args.num_examples,))
+    dataset = TensorDataset(features, lengths, labels)
+    prefetcher = concurrent.futures.ThreadPoolExecutor(args.prefetch_batches)
+    loaders = {
+        "DataLoader": lambda shuffle: DataLoader(
+            dataset, batch_size=args.batch_size, shuffle=shuffle, num_workers=args.num_workers,
+            persistent_workers=args.num_workers > 0),
+        "TensorBatchLoader": lambda shuffle: TensorBatchLoader(
+            dataset.tensors, args.batch_size, shuffle=shuffle, executor=prefetcher,
+            prefetch=args.prefetch_batches)
+    }
+    expected, actual = (list(loaders[name](False)) for name in loaders)
+    assert(all(torch.equal(x, y) for a, b in zip(expected, actual) for x, y in zip(a, b)))
+
+    print("{:>18} {:>10} {:>12} {:>8}".format("loader", "epoch (s)", "batches/s", "speedup"))
+    base_seconds = None
+    for name, make_loader in loaders.items():
+        loader = make_loader(True)
+        seconds = time_fn(epoch, loader, repeats=args.repeats)
+        base_seconds = base_seconds or seconds
+        print("{:>18} {:>10.3f} {:>12.1f} {:>7.2f}x".format(
+            name, seconds, len(loader) / seconds, base_seconds / seconds))
+    prefetcher.shutdown()
+
+
+def distributed_worker(rank, world_size, args, results):
+    """ Trains a model on random question pairs as one process of a
+        data-parallel run, checking that every process ends up with the same
+        parameters. The process of rank 0 reports the average epoch time.
+
+        Args:
+            rank: int
+                The rank of this process.
+            world_size: int
+                The number of processes.
+            args: argparse.Namespace
+                The parsed command line arguments.
+            results: multiprocessing.SimpleQueue
+                The queue that the process of rank 0 puts the epoch time in.
+
+        Returns:
+            None
+    """
+    os.environ.update(RANK=str(rank), WORLD_SIZE=str(world_size))
+    init_distributed()
+    torch.set_num_threads(max(1, args.threads // world_size))
+
+    # Every process builds the same model and dataset
+    torch.manual_seed(0)
+    model = make_model(args, "abcnn3")
+    model.embeddings.weight.requires_grad_(False)
+    features = torch.randint(args.vocab_size, (args.num_examples, 2, args.max_length))
+    lengths = torch.full((args.num_examples, 2), args.max_length)
+    labels = torch.randint(0, 2, (args.num_examples,))
+    dataset = TensorDataset(features, lengths, labels)
+    optimizer = torch.optim.Adagrad((p for p in model.parameters() if p.requires_grad), lr=0.005)
+    with tempfile.TemporaryDirectory() as directory:
+        trainer = MulticlassClassifierTrainer({
+            "batch_size": args.batch_size,
+            "num_epochs": 1,
+            "log_every": 0,
+            "num_workers": 0,
+            "checkpoint_dir": directory,
+            "verbose": False,
+            "device": "cpu",
+            "shuffle": True,
+            "environment": "script"
+        })
+        seconds = time_fn(trainer.train, nn.CrossEntropyLoss(), model, optimizer, dataset,
+            repeats=args.repeats)
+
+    # The gradient all-reduces keep the replicas in sync
+    params = torch.cat([p.detach().flatten() for p in model.parameters()])
+    assert all(torch.equal(params, other) for other in all_gather(params))
+    if rank == 0:
+        results.put(seconds)
+    if world_size > 1:
+        torch.distributed.destroy_process_group()
+
+
+def benchmark_distributed(args):
+    """ Compares the epoch time of data-parallel training with different
+        numbers of processes on the CPU, splitting the same number of threads
+        between the processes. Each process trains on batches of batch_size
+        examples, so the processes together take fewer, larger steps.
+
+        Args:
+            args: argparse.Namespace
+                The parsed command line arguments.
+
+        Returns:
+            None
+    """
+    os.environ.setdefault("MASTER_ADDR", "127.0.0.1")
+    context = mp.get_context("spawn")
+    print("{:>10} {:>8} {:>10} {:>10} {:>8}".format(
+        "processes", "threads", "epoch (s)", "pairs/s", "speedup"))
+    base_seconds = None
+    for port, world_size in enumerate(args.processes, start=args.port):
+        os.environ["MASTER_PORT"] = str(port)
+        results = context.SimpleQueue()
+        mp.spawn(distributed_worker, args=(world_size, args, results), nprocs=world_size)
+        seconds = results.get()
+        base_seconds = base_seconds or seconds
+        print("{:>10} {:>8} {:>10.2f} {:>10.0f} {:>7.2f}x".format(
+            world_size, max(1, args.threads // world_size), seconds,
+            args.num_examples / seconds, base_seconds / seconds))
+
+
+# Parse command line arguments
+parser = argparse.ArgumentParser()
+parser.add_argument("--repeats", type=int, default=10,
+    help="the number of timed calls to average over.")
+subparsers = parser.add_subparsers(dest="benchmark")
+subparsers.required = True
+
+attention_parser = subparsers.add_parser("attention",
+    help="batched vs. looped attention-matrix computation.")
+attention_parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 16, 64],
+    help="the batch sizes to benchmark.")
+attention_parser.add_argument("--lengths", type=int, nargs="+", default=[10, 20, 40],
+    help="the sequence lengths to benchmark.")
+attention_parser.add_argument("--input_size", type=int, default=300,
+    help="the dimension of the input features.")
+attention_parser.add_argument("--check_only", action="store_true", default=False,
+    help="only check the batched computation against the reference loop, without timing.")
+attention_parser.set_defaults(run=benchmark_attention)
+
+# Arguments shared by the benchmarks that build a whole model
+model_parser = argparse.ArgumentParser(add_help=False)
+model_parser.add_argument("--batch_size", type=int, default=64,
+    help="the number of question pairs per batch.")
+model_parser.add_argument("--max_length", type=int, default=20,
+    help="the length of the sequences.")
+model_parser.add_argument("--input_size", type=int, default=300,
+    help="the dimension of the word embeddings.")
+model_parser.add_argument("--output_size", type=int, default=50,
+    help="the number of filters in each convolutional layer.")
+model_parser.add_argument("--width", type=int, default=3,
+    help="the width of the convolution filters.")
+model_parser.add_argument("--num_layers", type=int, default=2,
+    help="the number of layers in the model.")
+model_parser.add_argument("--vocab_size", type=int, default=10000,
+    help="the number of rows in the embedding matrix.")
+
+siamese_parser = subparsers.add_parser("siamese", parents=[model_parser],
+    help="training throughput with and without siamese branch batching.")
+siamese_parser.set_defaults(run=benchmark_siamese)
+
+precision_parser = subparsers.add_parser("precision", parents=[model_parser],
+    help="fp32 vs. reduced-precision autocast inference on the CPU.")
+precision_parser.add_argument("--dtype", type=str, default="bfloat16",
+    choices=["bfloat16", "float16"],
+    help="the reduced-precision dtype to autocast to.")
+precision_parser.set_defaults(run=benchmark_precision)
+
+quantization_parser = subparsers.add_parser("quantization", parents=[model_parser],
+    help="fp32 vs. int8 embedding matrix memory, inference throughput and score drift.")
+quantization_parser.set_defaults(run=benchmark_quantization)
+
+checkpoint_parser = subparsers.add_parser("checkpoint", parents=[model_parser],
+    help="training throughput and activation memory with activation checkpointing.")
+checkpoint_parser.set_defaults(run=benchmark_checkpointing)
+
+tokenizer_parser = subparsers.add_parser("tokenizer",
+    help="reference re.sub chain vs. compiled tokenizer throughput.")
+tokenizer_parser.add_argument("--data_path", type=str, default=None,
+    help="a CSV file with question1 and question2 columns to tokenize. If not given, random questions are generated.")
+tokenizer_parser.add_argument("--num_questions", type=int, default=100000,
+    help="the number of random questions to generate.")
+tokenizer_parser.set_defaults(run=benchmark_tokenizer)
+
+preprocessing_parser = subparsers.add_parser("preprocessing",
+    help="dataset setup time with different numbers of worker processes.")
+preprocessing_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8],
+    help="the numbers of worker processes to benchmark.")
+preprocessing_parser.add_argument("--num_pairs", type=int, default=200000,
+    help="the number of question pairs in each of the three random datasets.")
+preprocessing_parser.add_argument("--max_length", type=int, default=20,
+    help="the length to truncate or pad the questions to.")
+preprocessing_parser.set_defaults(run=benchmark_preprocessing)
+
+loader_parser = subparsers.add_parser("loader",
+    help="DataLoader vs. TensorBatchLoader epoch time over resident tensors.")
+loader_parser.add_argument("--num_examples", type=int, default=300000,
+    help="the number of question pairs in the random dataset.")
+loader_parser.add_argument("--batch_size", type=int, default=64,
+    help="the number of question pairs per batch.")
+loader_parser.add_argument("--max_length", type=int, default=20,
+    help="the length of the questions.")
+loader_parser.add_argument("--num_workers", type=int, default=8,
+    help="the number of DataLoader worker processes.")
+loader_parser.add_argument("--prefetch_batches", type=int, default=2,
+    help="the number of batches that the TensorBatchLoader gathers ahead of time.")
+loader_parser.set_defaults(run=benchmark_loader)
+
+distributed_parser = subparsers.add_parser("distributed", parents=[model_parser],
+    help="data-parallel training epoch time with different numbers of CPU processes.")
+distributed_parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4, 8],
+    help="the numbers of processes to benchmark.")
+distributed_parser.add_argument("--threads", type=int, default=os.cpu_count(),
+    help="the total number of threads, split evenly between the processes.")
+distributed_parser.add_argument("--num_examples", type=int, default=20000,
+    help="the number of question pairs in the random training set.")
+distributed_parser.add_argument("--port", type=int, default=29500,
+    help="the first port for the processes to rendezvous on, incremented for each run.")
+distributed_parser.set_defaults(run=benchmark_distributed)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    args.run(args)
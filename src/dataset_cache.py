@@ -0,0 +1,390 @@
+# coding=utf-8
+
+import contextlib
+import hashlib
+import json
+import numpy as np
+import os
+import shutil
+import tempfile
+import torch
+
+import tokenizer
+from tokenizer import vocabulary_settings
+
+# Bump whenever the layout of the cached files changes
+CACHE_FORMAT_VERSION = 3
+
+# The number of bytes hashed at a time when fingerprinting data files
+HASH_BLOCK_SIZE = 2 ** 20
+
+# The kinds of arrays stored for each dataset
+ARRAY_KINDS = ["examples", "lengths", "labels"]
+
+# The number of rows converted at a time when changing the type of a file
+CONVERT_BLOCK_ROWS = 2 ** 16
+
+def compact_dtype(max_value):
+    """ Finds the narrowest integer type that can store values from 0 up to
+        and including max_value. Only types that torch supports for every
+        operation are considered, so unsigned types wider than 8 bits are not.
+
+        Args:
+            max_value: int
+                The largest value to store.
+
+        Returns:
+            dtype: np.dtype
+                The narrowest integer type.
+    """
+    for dtype in [np.uint8, np.int16, np.int32]:
+        if max_value <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+class GrowableArray(object):
+    """ An array that grows along its first axis as rows are appended to it,
+        without knowing the final number of rows in advance. The rows are
+        kept either in memory or in a memory-mapped file, whose capacity is
+        doubled whenever it runs out.
+
+        Args:
+            row_shape: tuple of int
+                The shape of each row.
+            dtype: np.dtype
+                The type of the elements.
+            path: string or None
+                The file to store the rows in. If None, then the rows are kept
+                in memory.
+            capacity: int
+                The initial number of rows to allocate.
+    """
+
+    def __init__(self, row_shape, dtype, path=None, capacity=1024):
+        self.row_shape = tuple(row_shape)
+        self.dtype = np.dtype(dtype)
+        self.path = path
+        self.length = 0
+        self.data = None
+        if path is not None:
+            open(path, "wb").close()
+        self._reserve(capacity)
+
+    def append(self, rows):
+        """ Copies rows to the end of the array, growing it if necessary.
+
+            Args:
+                rows: np.ndarray of shape (num_rows, *row_shape)
+                    The rows to append.
+
+            Returns:
+                None
+        """
+        end = self.length + len(rows)
+        if end > self.capacity:
+            self._reserve(max(end, 2 * self.capacity))
+        self.data[self.length:end] = rows
+        self.length = end
+
+    def finish(self, dtype=None, lookup=None):
+        """ Shrinks the array to the rows appended so far.
+
+            Args:
+                dtype: np.dtype or None
+                    The type to convert the elements to. If None, then the
+                    elements keep their type.
+                lookup: np.ndarray or None
+                    A table to map the elements through, indexed by their
+                    values. If None, then the values are kept.
+
+            Returns:
+                array: np.ndarray of shape (length, *row_shape)
+                    The rows, backed by the file if there is one.
+        """
+        shape = (self.length,) + self.row_shape
+        dtype = self.dtype if dtype is None else np.dtype(dtype)
+
+        def convert(rows):
+            return (rows if lookup is None else lookup[rows]).astype(dtype)
+
+        if self.path is None:
+            if dtype != self.dtype or lookup is not None:
+                converted = convert(self.data[:self.length])
+                self.data = None
+                return converted
+            self.data.resize(shape, refcheck=False)
+            return self.data
+
+        self._reserve(self.length)
+        if dtype != self.dtype or lookup is not None:
+            # Convert the file in blocks of rows, so it never has to fit in memory
+            temp_path = self.path + ".tmp"
+            converted = GrowableArray(self.row_shape, dtype, path=temp_path, capacity=max(self.length, 1))
+            for start in range(0, self.length, CONVERT_BLOCK_ROWS):
+                converted.append(convert(self.data[start:start + CONVERT_BLOCK_ROWS]))
+            converted.finish()
+            self.data = None
+            os.replace(temp_path, self.path)
+        return open_array(self.path, dtype, shape)
+
+    def _reserve(self, capacity):
+        shape = (capacity,) + self.row_shape
+        if self.path is None:
+            if self.data is None:
+                self.data = np.empty(shape, dtype=self.dtype)
+            else:
+                # Reallocates in place where possible instead of copying
+                self.data.resize(shape, refcheck=False)
+        else:
+            if self.data is not None:
+                self.data.flush()
+                self.data = None
+            with open(self.path, "r+b") as stream:
+                stream.truncate(capacity * self.dtype.itemsize * int(np.prod(self.row_shape)))
+            self.data = open_array(self.path, self.dtype, shape, mode="r+")
+        self.capacity = capacity
+
+
+def open_array(path, dtype, shape, mode="c"):
+    """ Memory-maps an array stored as raw bytes. Empty arrays cannot be
+        memory-mapped, so they are allocated in memory instead.
+
+        Args:
+            path: string
+                The file storing the array.
+            dtype: np.dtype
+                The type of the elements.
+            shape: tuple of int
+                The shape of the array.
+            mode: string
+                The np.memmap mode. Defaults to copy-on-write.
+
+        Returns:
+            array: np.ndarray
+                The array.
+    """
+    if int(np.prod(shape)) == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode=mode, shape=shape)
+
+
+def array_path(directory, index, kind):
+    """ Returns the file that stores one kind of array of a dataset.
+
+        Args:
+            directory: string
+                The directory of the cache entry.
+            index: int
+                The position of the dataset in data_paths.
+            kind: string
+                One of ARRAY_KINDS.
+
+        Returns:
+            path: string
+                The path to the file.
+    """
+    return os.path.join(directory, "{}.{}.bin".format(index, kind))
+
+
+def dataset_cache_key(config):
+    """ Computes the key of the cached datasets for the given config. The key
+        changes whenever the contents of any data file, the names or order of
+        the datasets, the maximum length, the tokenizer version, the stop
+        words or the vocabulary pruning settings change.
+
+        Args:
+            config: dict
+                Contains the information needed to initialize the datasets.
+
+        Returns:
+            key: string
+                A hex digest identifying the tokenized datasets.
+    """
+    data_files = []
+    for name, path in config["data_paths"].items():
+        digest = hashlib.sha256()
+        with open(path, "rb") as stream:
+            for block in iter(lambda: stream.read(HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+        data_files.append([name, digest.hexdigest()])
+
+    fingerprint = {
+        "format_version": CACHE_FORMAT_VERSION,
+        "tokenizer_version": tokenizer.VERSION,
+        "stop_words": sorted(tokenizer.english_stop_words()),
+        "max_length": config["max_length"],
+        "vocabulary": vocabulary_settings(config),
+        "data_files": data_files,
+    }
+    return hashlib.sha256(json.dumps(fingerprint).encode("utf-8")).hexdigest()
+
+
+def embeddings_cache_key(config, word2index):
+    """ Computes the key of the cached pre-trained vectors of a vocabulary.
+        The embeddings file is identified by its path, size and modification
+        time rather than by hashing its contents, since the files are several
+        gigabytes large. The vocabulary is identified by a hash of its words
+        in index order.
+
+        Args:
+            config: dict
+                Contains the information needed to initialize the embeddings.
+            word2index: dict
+                Maps words to indices in the embedding matrix.
+
+        Returns:
+            key: string
+                A hex digest identifying the pre-trained vectors.
+    """
+    embeddings_config = config["embeddings"]
+    stat = os.stat(embeddings_config["path"])
+    vocabulary = hashlib.sha256()
+    for word in sorted(word2index, key=word2index.get):
+        vocabulary.update(word.encode("utf-8") + b"\0")
+
+    fingerprint = {
+        "format_version": CACHE_FORMAT_VERSION,
+        "path": os.path.abspath(embeddings_config["path"]),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "format": embeddings_config["format"],
+        "is_binary": embeddings_config["is_binary"],
+        "vocabulary": vocabulary.hexdigest(),
+    }
+    return hashlib.sha256(json.dumps(fingerprint).encode("utf-8")).hexdigest()
+
+
+def load_word_vectors(directory):
+    """ Loads the pre-trained vectors of a vocabulary saved by
+        save_word_vectors, memory-mapped copy-on-write.
+
+        Args:
+            directory: string
+                The directory that the vectors were saved to.
+
+        Returns:
+            rows, vectors, or None if the directory does not exist. See
+            lookup_word_vectors in setup.py.
+    """
+    if not os.path.isdir(directory):
+        return None
+
+    with open(os.path.join(directory, "metadata.json"), "r") as stream:
+        metadata = json.load(stream)
+    num_vectors, vector_size = metadata["shape"]
+    rows = open_array(os.path.join(directory, "rows.bin"), np.int64, (num_vectors,))
+    vectors = open_array(os.path.join(directory, "vectors.bin"), np.float32, (num_vectors, vector_size))
+    return rows, vectors
+
+
+def save_word_vectors(directory, rows, vectors):
+    """ Saves the pre-trained vectors of a vocabulary so that they can be
+        loaded by load_word_vectors.
+
+        Args:
+            directory: string
+                The directory to save the vectors to.
+            rows, vectors:
+                The outputs of lookup_word_vectors in setup.py.
+
+        Returns:
+            None
+    """
+    rows.astype(np.int64, copy=False).tofile(os.path.join(directory, "rows.bin"))
+    vectors.astype(np.float32, copy=False).tofile(os.path.join(directory, "vectors.bin"))
+    with open(os.path.join(directory, "metadata.json"), "w") as stream:
+        json.dump({"shape": list(vectors.shape)}, stream)
+
+
+def load_datasets(directory):
+    """ Loads tokenized datasets saved by save_datasets. The example, length
+        and label arrays are memory-mapped copy-on-write, so only the parts
+        that are used are read from disk.
+
+        Args:
+            directory: string
+                The directory that the datasets were saved to.
+
+        Returns:
+            examples, lengths, labels, word2index, or None if the directory
+            does not exist. See setup_datasets in setup.py.
+    """
+    if not os.path.isdir(directory):
+        return None
+
+    with open(os.path.join(directory, "metadata.json"), "r") as stream:
+        metadata = json.load(stream)
+
+    datasets = {kind: {} for kind in ARRAY_KINDS}
+    for i, name in enumerate(metadata["names"]):
+        for kind in ARRAY_KINDS:
+            dtype, shape = metadata["arrays"]["{}.{}".format(i, kind)]
+            array = open_array(array_path(directory, i, kind), dtype, tuple(shape))
+            datasets[kind][name] = torch.from_numpy(array)
+    word2index = {word: index for index, word in enumerate(metadata["words"])}
+    return datasets["examples"], datasets["lengths"], datasets["labels"], word2index
+
+
+def save_datasets(directory, examples, lengths, labels, word2index):
+    """ Saves tokenized datasets so that they can be loaded by load_datasets.
+        Arrays whose files were already written to the directory, such as the
+        ones that tokenize_datasets streams to disk, are not written again.
+
+        Args:
+            directory: string
+                The directory to save the datasets to.
+            examples, lengths, labels, word2index:
+                The outputs of setup_datasets in setup.py.
+
+        Returns:
+            None
+    """
+    datasets = {"examples": examples, "lengths": lengths, "labels": labels}
+    names = list(examples)
+    arrays = {}
+    for i, name in enumerate(names):
+        for kind in ARRAY_KINDS:
+            array = datasets[kind][name].numpy()
+            path = array_path(directory, i, kind)
+            if not os.path.isfile(path):
+                array.tofile(path)
+            arrays["{}.{}".format(i, kind)] = [array.dtype.str, list(array.shape)]
+
+    # Words are stored in index order
+    metadata = {
+        "names": names,
+        "arrays": arrays,
+        "words": sorted(word2index, key=word2index.get)
+    }
+    with open(os.path.join(directory, "metadata.json"), "w") as stream:
+        json.dump(metadata, stream)
+
+
+@contextlib.contextmanager
+def cache_entry(directory):
+    """ Creates a cache entry atomically. The files are written to a temporary
+        directory, which is renamed to the entry's directory once the block
+        finishes, so a partially written entry is never loaded.
+
+        Args:
+            directory: string
+                The directory of the cache entry.
+
+        Yields:
+            temp_directory: string
+                The directory to write the files of the entry to.
+    """
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    temp_directory = tempfile.mkdtemp(dir=parent)
+    try:
+        yield temp_directory
+        try:
+            os.rename(temp_directory, directory)
+        except OSError:
+            # Another process may have saved the same entry first
+            if not os.path.isdir(directory):
+                raise
+    finally:
+        shutil.rmtree(temp_directory, ignore_errors=True)
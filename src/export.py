@@ -0,0 +1,120 @@
+# coding=utf-8
+
+import argparse
+import json
+import os
+import torch
+import torch.nn as nn
+import warnings
+
+from model.embeddings.quantized import QuantizedEmbedding
+from serving import load_exported_model
+from setup import read_config
+from setup import setup_model
+from utils import load_checkpoint
+
+def export_model(model, max_length, filepath):
+    """ Traces the forward pass of the ABCNN model into a TorchScript graph
+        and saves it to disk. The graph takes a batch of question pairs padded
+        to max_length along with their true lengths, and can be loaded with
+        serving.load_exported_model without the training code.
+
+        Args:
+            model: ABCNN model
+                The model to export.
+            max_length: int
+                The length that every question is padded to.
+            filepath: string
+                The path where the exported model will be saved.
+
+        Returns:
+            exported: torch.jit.ScriptModule
+                The exported model.
+    """
+    model = model.cpu().eval()
+    inputs = torch.ones((2, 2, max_length), dtype=torch.long)
+    lengths = torch.full((2, 2), max_length, dtype=torch.long)
+
+    # Trimming the batch to its longest question is baked in as a constant
+    # when tracing, which is a no-op for batches padded to max_length.
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter("ignore", torch.jit.TracerWarning)
+        exported = torch.jit.trace(model, (inputs, lengths))
+
+    metadata = {"max_length": max_length}
+    torch.jit.save(exported, filepath, _extra_files={"metadata.json": json.dumps(metadata)})
+    return exported
+
+
+def check_export_parity(exported, model, max_length, batch_size=64):
+    """ Compares the scores of an exported model against the scores of the
+        eager model it was exported from on random question pairs.
+
+        Args:
+            exported: torch.jit.ScriptModule
+                The exported model.
+            model: ABCNN model
+                The eager model.
+            max_length: int
+                The length that every question is padded to.
+            batch_size: int
+                The number of random question pairs to compare on.
+
+        Returns:
+            max_error: float
+                The largest absolute difference between the two sets of scores.
+    """
+    vocab_size = model.embeddings.num_embeddings
+    lengths = torch.randint(0, max_length + 1, (batch_size, 2))
+    inputs = torch.randint(1, vocab_size, (batch_size, 2, max_length))
+    inputs = inputs.masked_fill(torch.arange(max_length) >= lengths.unsqueeze(2), 0)
+    model.eval()
+    with torch.no_grad():
+        expected = model(inputs, lengths)
+        actual = exported(inputs, lengths)
+    return torch.max(torch.abs(actual - expected)).item()
+
+
+if __name__ == "__main__":
+    # Parse command line arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config_path", type=str,
+        help="path to the config file")
+    parser.add_argument("checkpoint_path", type=str,
+        help="path to the checkpoint file of the model to export.")
+    parser.add_argument("output_path", type=str,
+        help="path where the exported model will be saved.")
+    parser.add_argument("--tolerance", type=float, default=1e-4,
+        help="the largest score difference allowed between the exported and eager models.")
+    args = parser.parse_args()
+
+    # Sanity check command line arguments
+    assert(os.path.isfile(args.config_path))
+    assert(os.path.isfile(args.checkpoint_path))
+
+    # Rebuild the model from its checkpoint. The embedding matrix cannot be
+    # rebuilt from the config, since the rows of words without a pre-trained
+    # vector (and the OOV buckets) were drawn at random for training.
+    config = read_config(args.config_path)["model"]
+    model_dict = load_checkpoint(args.checkpoint_path, map_location="cpu")[0]
+    if "embeddings.scales" in model_dict:
+        embeddings = QuantizedEmbedding(model_dict["embeddings.weight"], model_dict["embeddings.scales"])
+    elif "embeddings.weight" in model_dict:
+        embeddings = nn.Embedding.from_pretrained(model_dict["embeddings.weight"])
+    else:
+        parser.error(
+            "the checkpoint has no embedding matrix. Set checkpoint_frozen in the "
+            "trainer config to save it with the model, then train and export again.")
+    model = setup_model(config, embeddings)
+    model_state = model.state_dict()
+    model_state.update(model_dict)
+    model.load_state_dict(model_state)
+
+    # Export the model and check it against the eager model
+    max_length = config["max_length"]
+    export_model(model, max_length, args.output_path)
+    exported, _ = load_exported_model(args.output_path)
+    max_error = check_export_parity(exported, model, max_length)
+    print("Largest score difference between exported and eager models: {}".format(max_error))
+    assert(max_error <= args.tolerance)
+    print("Exported model saved to: {}".format(args.output_path))
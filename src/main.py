@@ -7,6 +7,7 @@ from torch.utils.data import TensorDataset
 from trainer.factories import loss_fn_factory
 from trainer.factories import optimizer_factory
 from trainer.factories import scheduler_factory
+from trainer.distributed import init_distributed
 from trainer.multiclass_classifier_trainer import MulticlassClassifierTrainer
 from trainer.utils import move_to_device
 from setup import read_config
@@ -36,12 +37,15 @@ assert(os.path.isfile(args.config_path))
 assert(args.load is None or os.path.isfile(args.load))
 assert(args.train or args.predict)
 
+# Join the other processes when launched with torchrun for data-parallel training
+init_distributed()
+
 # Initial setup
 config = read_config(args.config_path)
-features, labels, model = setup(config["model"])
+features, lengths, labels, model = setup(config["model"])
 model = move_to_device(config["trainer"]["device"], model) # model needs to be on correct device BEFORE optimizer is initialized
 datasets = {
-    name: TensorDataset(features[name], labels[name])
+    name: TensorDataset(features[name], lengths[name], labels[name])
     for name in features
 }
 loss_fn = loss_fn_factory(config["loss_fn"])
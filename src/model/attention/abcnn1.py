@@ -7,6 +7,7 @@ from model.attention.utils import compute_attention_matrix
 from model.attention.utils import cosine
 from model.attention.utils import euclidean
 from model.attention.utils import manhattan
+from model.attention.utils import mask_attention_matrix
 
 class ABCNN1Attention(nn.Module):
     """ Implements the attention mechanism for the ABCNN-1 model described 
@@ -35,12 +36,13 @@ class ABCNN1Attention(nn.Module):
         """
         super().__init__()
         
-        # Initialize weights
-        W = nn.Parameter(torch.Tensor(max_length, input_size))
-        W1 = nn.Parameter(torch.Tensor(max_length, input_size))
-        W2 = nn.Parameter(torch.Tensor(max_length, input_size))
-        self.W1 = W if share_weights else W1
-        self.W2 = W if share_weights else W2
+        # Initialize weights. A shared weight is only registered as W1, since
+        # TorchScript cannot trace a parameter registered under two names.
+        self.W1 = nn.Parameter(torch.Tensor(max_length, input_size))
+        if share_weights:
+            self.register_parameter("W2", None)
+        else:
+            self.W2 = nn.Parameter(torch.Tensor(max_length, input_size))
        
         # Choose match-score function
         functions = {
@@ -50,28 +52,51 @@ class ABCNN1Attention(nn.Module):
         }
         self.match_score = functions[match_score]
 
-    def forward(self, x1, x2):
+    def forward(self, x1, x2, lengths1=None, lengths2=None, attention_matrices=None):
         """ Computes the forward pass for the attention layer of the ABCNN-1
             Block.
 
             Args:
                 x1, x2: torch.Tensors of shape (batch_size, 1, max_length, input_size)
-                    The inputs to the ABCNN-1 Block.
+                    The inputs to the ABCNN-1 Block. The sequences may be
+                    shorter than the max_length the layer was created with.
+                lengths1, lengths2: torch.LongTensors of shape (batch_size,)
+                    Optional, the true lengths of the sequences in x1 and x2.
+                    If provided, then padding positions get no attention.
+                attention_matrices: dict
+                    Optional, a memo of the attention matrices already computed
+                    for x1 and x2, keyed by match-score function. If provided,
+                    then the attention matrix is looked up in (or added to) the
+                    memo instead of always being recomputed.
 
             Returns:
                 attn1, attn2: torch.Tensors of shape (batch_size, 2, max_length, input_size)
                     The output of the attention layer for the ABCNN-1 Block.
         """
         # Get attention matrix and its transpose
-        A = compute_attention_matrix(x1, x2, self.match_score)
-        A = A.cuda() if self.W1.is_cuda else A
+        if attention_matrices is not None and self.match_score in attention_matrices:
+            A = attention_matrices[self.match_score]
+        else:
+            A = compute_attention_matrix(x1, x2, self.match_score)
+            A = mask_attention_matrix(A, lengths1, lengths2)
+            if attention_matrices is not None:
+                attention_matrices[self.match_score] = A
         A_t = A.permute(0, 1, 3, 2)
 
         # Compute attention feature maps
-        a1 = torch.matmul(A, self.W1)
-        a2 = torch.matmul(A_t, self.W2)
+        W2 = self.W1 if self.W2 is None else self.W2
+        a1 = torch.matmul(A, self.W1[:A.shape[3]])
+        a2 = torch.matmul(A_t, W2[:A.shape[2]])
 
         # Stack attention feature maps with inputs
         attn1 = torch.cat([x1, a1], dim=1)
         attn2 = torch.cat([x2, a2], dim=1)
         return attn1, attn2
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        """ Drops the W2 of checkpoints saved when a shared weight was
+            registered as both W1 and W2, so that they still load.
+        """
+        if self.W2 is None:
+            state_dict.pop(prefix + "W2", None)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
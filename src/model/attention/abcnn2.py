@@ -7,6 +7,9 @@ from model.attention.utils import compute_attention_matrix
 from model.attention.utils import cosine
 from model.attention.utils import euclidean
 from model.attention.utils import manhattan
+from model.attention.utils import mask_attention_matrix
+from model.utils import convolution_lengths
+from model.utils import mask_rows
 
 class ABCNN2Attention(nn.Module):
     """ Implements the attention mechanism for the ABCNN-2 model described 
@@ -31,13 +34,18 @@ class ABCNN2Attention(nn.Module):
         }
         self.match_score = functions[match_score]
 
-    def forward(self, x1, x2):
+    def forward(self, x1, x2, lengths1=None, lengths2=None):
         """ Computes the forward pass for the attention layer of the ABCNN-2
             Block.
 
             Args:
                 x1, x2: torch.Tensors of shape (batch_size, 1, max_length + width - 1, output_size)
                     The outputs from the convolutional layer.
+                lengths1, lengths2: torch.LongTensors of shape (batch_size,)
+                    Optional, the true lengths of the sequences that x1 and x2
+                    were computed from. If provided, then padding positions get
+                    no attention and the output columns past each length are
+                    set to 0.
 
             Returns:
                 w1, w2: torch.Tensors of shape (batch_size, 1, max_length, output_size)
@@ -47,22 +55,15 @@ class ABCNN2Attention(nn.Module):
         """
         # Compute attention matrix for outputs of convolutional layer
         A = compute_attention_matrix(x1, x2, self.match_score)
+        if lengths1 is not None:
+            A = mask_attention_matrix(
+                A, convolution_lengths(lengths1, self.width), convolution_lengths(lengths2, self.width))
 
-        # Initialize outputs for attention layer
-        batch_size = x1.shape[0]
-        output_size = x1.shape[3]
-        w1 = torch.zeros((batch_size, 1, self.max_length, output_size))
-        w2 = torch.zeros((batch_size, 1, self.max_length, output_size))
-        w1 = w1.cuda() if x1.is_cuda else w1
-        w2 = w2.cuda() if x2.is_cuda else w2
+        # Compute the attention weight of each column once
+        a1 = torch.sum(A, dim=2).unsqueeze(3) # shape (batch_size, 1, max_length + width - 1, 1)
+        a2 = torch.sum(A, dim=3).unsqueeze(3)
 
-        # Compute the outputs
-        for j in range(self.max_length):
-            for k in range(j, j + self.width):    
-                row_sum = torch.sum(A[:, :, :, k], dim=2, keepdim=True)
-                col_sum = torch.sum(A[:, :, k, :], dim=2, keepdim=True)
-                row_sum = row_sum.cuda() if x1.is_cuda else row_sum
-                col_sum = col_sum.cuda() if x2.is_cuda else col_sum
-                w1[:, :, j, :] += row_sum * x1[:, :, k, :]
-                w2[:, :, j, :] += col_sum * x2[:, :, k, :]
-        return w1, w2
+        # Sum the attention-weighted columns over each window of width columns
+        w1 = (a1 * x1).unfold(2, self.width, 1).sum(dim=4) # shape (batch_size, 1, max_length, output_size)
+        w2 = (a2 * x2).unfold(2, self.width, 1).sum(dim=4)
+        return mask_rows(w1, lengths1), mask_rows(w2, lengths2)
@@ -1,6 +1,13 @@
 # coding=utf-8
 
 import torch
+from torch.autograd.function import once_differentiable
+
+from model.utils import sequence_mask
+
+# The largest number of elements in the (rows, columns, input_size) blocks
+# of pairwise differences that TiledManhattanDistance works on at once
+MAX_TILE_ELEMENTS = 2 ** 22
 
 def compute_attention_matrix(x1, x2, match_score):
     """ Computes the attention feature map for the batch of inputs x1 and x2.
@@ -13,6 +20,31 @@ def compute_attention_matrix(x1, x2, match_score):
 
             A_{i, j} = match-score(F_{0, r}[:, i], F_{1, r}[:, j])
 
+        The built-in match-scores are computed for every (i, j) pair at once
+        using their batched counterparts in PAIRWISE_MATCH_SCORES. Any other
+        match-score function falls back to scoring one (i, j) pair at a time.
+
+        Args:
+            x1, x2: torch.Tensors of shape (batch_size, 1, max_length, input_size)
+                A batch of input tensors.
+            match_score: function
+                The match-score function to use.
+
+        Returns:
+            A: torch.Tensor of shape (batch_size, 1, max_length, max_length)
+                A batch of attention feature maps.
+    """
+    pairwise_match_score = PAIRWISE_MATCH_SCORES.get(match_score)
+    if pairwise_match_score is None:
+        return compute_attention_matrix_loop(x1, x2, match_score)
+    return pairwise_match_score(x1, x2)
+
+
+def compute_attention_matrix_loop(x1, x2, match_score):
+    """ Computes the attention feature map for the batch of inputs x1 and x2
+        by scoring one (i, j) pair of positions at a time. This is the
+        reference implementation for compute_attention_matrix.
+
         Args:
             x1, x2: torch.Tensors of shape (batch_size, 1, max_length, input_size)
                 A batch of input tensors.
@@ -25,7 +57,7 @@ def compute_attention_matrix(x1, x2, match_score):
     """
     batch_size = x1.shape[0]
     max_length = x1.shape[2]
-    A = torch.empty((batch_size, 1, max_length, max_length), dtype=torch.float)
+    A = x1.new_empty((batch_size, 1, max_length, max_length))
     for i in range(max_length):
         for j in range(max_length):
             b1 = x1[:, :, i, :]
@@ -33,6 +65,29 @@ def compute_attention_matrix(x1, x2, match_score):
             A[:, :, i, j] = match_score(b1, b2)
     return A
 
+def mask_attention_matrix(A, lengths1, lengths2):
+    """ Zeroes out the entries of a batch of attention feature maps that
+        involve a padding position of either sequence.
+
+        Args:
+            A: torch.Tensor of shape (batch_size, 1, max_length, max_length)
+                A batch of attention feature maps.
+            lengths1, lengths2: torch.LongTensors of shape (batch_size,) or None
+                The number of real rows of the feature maps that A was computed
+                from. If None, then A is returned unchanged.
+
+        Returns:
+            A: torch.Tensor of shape (batch_size, 1, max_length, max_length)
+                The attention feature maps with padding entries set to 0.
+    """
+    if lengths1 is None:
+        return A
+    mask1 = sequence_mask(lengths1, A.shape[2])
+    mask2 = sequence_mask(lengths2, A.shape[3])
+    mask = mask1[:, None, :, None] & mask2[:, None, None, :]
+    return A.masked_fill(~mask, 0)
+
+
 def manhattan(x1, x2):
     """ Computes the manhattan match-score on batches of vectors x1 and x2.
 
@@ -76,3 +131,114 @@ def cosine(x1, x2):
     norm_x1 = torch.norm(x1, p=2, dim=2)
     norm_x2 = torch.norm(x2, p=2, dim=2)
     return dot_products / (norm_x1 * norm_x2)
+
+
+def pairwise_manhattan(x1, x2):
+    """ Computes the manhattan match-score between every pair of rows in the
+        batches of feature maps x1 and x2.
+
+        Args:
+            x1, x2: torch.Tensors of shape (batch_size, 1, max_length, input_size)
+                The batches of feature maps we are computing match-scores for.
+
+        Returns:
+            A: torch.Tensor of shape (batch_size, 1, max_length, max_length)
+                The match-scores for every pair of rows in x1 and x2.
+    """
+    return 1.0 / (1.0 + _cdist(x1, x2, p=1))
+
+
+def pairwise_euclidean(x1, x2):
+    """ Computes the euclidean match-score between every pair of rows in the
+        batches of feature maps x1 and x2.
+
+        Args:
+            x1, x2: torch.Tensors of shape (batch_size, 1, max_length, input_size)
+                The batches of feature maps we are computing match-scores for.
+
+        Returns:
+            A: torch.Tensor of shape (batch_size, 1, max_length, max_length)
+                The match-scores for every pair of rows in x1 and x2.
+    """
+    distances = _cdist(x1, x2, p=2, compute_mode="use_mm_for_euclid_dist")
+    return 1.0 / (1.0 + distances)
+
+
+def pairwise_cosine(x1, x2):
+    """ Computes the cosine match-score between every pair of rows in the
+        batches of feature maps x1 and x2.
+
+        Args:
+            x1, x2: torch.Tensors of shape (batch_size, 1, max_length, input_size)
+                The batches of feature maps we are computing match-scores for.
+
+        Returns:
+            A: torch.Tensor of shape (batch_size, 1, max_length, max_length)
+                The match-scores for every pair of rows in x1 and x2.
+    """
+    dot_products = torch.matmul(x1, x2.transpose(2, 3))
+    norm_x1 = torch.norm(x1, p=2, dim=3, keepdim=True)
+    norm_x2 = torch.norm(x2, p=2, dim=3, keepdim=True)
+    return dot_products / torch.matmul(norm_x1, norm_x2.transpose(2, 3))
+
+
+class TiledManhattanDistance(torch.autograd.Function):
+    """ Computes the manhattan distance between every pair of rows in two
+        batches of feature maps with a memory-bounded backward pass.
+
+        The CUDA backward pass of torch.cdist materializes every pairwise
+        difference at once, which takes memory proportional to L^2 * d for
+        sequences of length L with d features. Here the differences are
+        recomputed in tiles of rows and columns instead, so only the inputs
+        and the L^2 distances are kept for the backward pass.
+    """
+
+    @staticmethod
+    def forward(ctx, x1, x2):
+        ctx.save_for_backward(x1, x2)
+        return torch.cdist(x1, x2, p=1)
+
+    @staticmethod
+    @once_differentiable
+    def backward(ctx, grad):
+        x1, x2 = ctx.saved_tensors
+        grad_x1 = torch.zeros_like(x1)
+        grad_x2 = torch.zeros_like(x2)
+
+        # Pick square tiles whose pairwise differences fit in MAX_TILE_ELEMENTS
+        batch_elements = x1[..., 0, :].numel()
+        tile_size = max(1, int((MAX_TILE_ELEMENTS / batch_elements) ** 0.5))
+
+        for i in range(0, x1.shape[-2], tile_size):
+            for j in range(0, x2.shape[-2], tile_size):
+                rows = x1[..., i:i + tile_size, :].unsqueeze(-2)
+                cols = x2[..., j:j + tile_size, :].unsqueeze(-3)
+                tile_grad = grad[..., i:i + tile_size, j:j + tile_size].unsqueeze(-1)
+                weighted_signs = torch.sub(rows, cols).sign_().mul_(tile_grad) # shape (..., rows, cols, input_size)
+                grad_x1[..., i:i + tile_size, :] += torch.sum(weighted_signs, dim=-2)
+                grad_x2[..., j:j + tile_size, :] -= torch.sum(weighted_signs, dim=-3)
+        return grad_x1, grad_x2
+
+
+def _cdist(x1, x2, p, **kwargs):
+    """ Computes the p-norm distance between every pair of rows in x1 and x2
+        in at least single precision, since torch.cdist does not support
+        reduced-precision inputs on every device. The distances are returned
+        in the dtype of x1. Manhattan distances off the CPU use
+        TiledManhattanDistance to bound the memory of the backward pass; the
+        CPU kernel of torch.cdist already accumulates its gradients in place.
+    """
+    dtype = torch.promote_types(x1.dtype, torch.float)
+    if p == 1 and x1.device.type != "cpu":
+        distances = TiledManhattanDistance.apply(x1.to(dtype), x2.to(dtype))
+    else:
+        distances = torch.cdist(x1.to(dtype), x2.to(dtype), p=p, **kwargs)
+    return distances.to(x1.dtype)
+
+
+# Maps each match-score function to its batched counterpart
+PAIRWISE_MATCH_SCORES = {
+    manhattan: pairwise_manhattan,
+    euclidean: pairwise_euclidean,
+    cosine: pairwise_cosine
+}
@@ -4,6 +4,7 @@ import torch
 import torch.nn as nn
 
 from model.pooling.allap import AllAP
+from model.utils import siamese
 
 class ABCNN1Block(nn.Module):
     """ Implements a single ABCNN-1 Block as described in this paper: 
@@ -11,7 +12,7 @@ class ABCNN1Block(nn.Module):
         http://www.aclweb.org/anthology/Q16-1019
     """
     
-    def __init__(self, attn, conv, pool, dropout_rate=0.5):
+    def __init__(self, attn, conv, pool, dropout_rate=0.5, batch_pairs=False):
         """ Initializes the ABCNN-1 Block. 
 
             Args:
@@ -21,6 +22,10 @@ class ABCNN1Block(nn.Module):
                     The Convolutional layer for the ABCNN-1 Block.
                 pool: WidthAP Module
                     The w-ap Average Pooling layer for the ABCNN-1 Block.
+                batch_pairs: boolean
+                    Specifies whether to stack both sides of the pairs along
+                    the batch axis so the shared layers run once per forward
+                    pass.
         """
         super().__init__()
         self.conv = conv
@@ -28,13 +33,21 @@ class ABCNN1Block(nn.Module):
         self.pool = pool
         self.ap = AllAP()
         self.dropout = nn.Dropout2d(p=dropout_rate)
+        self.batch_pairs = batch_pairs
     
-    def forward(self, x1, x2):
+    def forward(self, x1, x2, lengths1=None, lengths2=None, attention_matrices=None):
         """ Computes the forward pass over the ABCNN-1 Block.
 
             Args:
                 x1, x2: torch.Tensors of shape (batch_size, 1, max_length, input_size)
                     The inputs to the ABCNN-1 Block.
+                lengths1, lengths2: torch.LongTensors of shape (batch_size,)
+                    Optional, the true lengths of the sequences in x1 and x2.
+                    If provided, then padding positions are masked out.
+                attention_matrices: dict
+                    Optional, a memo of the attention matrices computed for x1
+                    and x2 that is shared by the Blocks of a Layer during a
+                    single forward pass.
 
             Returns:
                 w1, w2: torch.Tensors of shape (batch_size, 1, max_length, output_size)
@@ -44,9 +57,26 @@ class ABCNN1Block(nn.Module):
                     The outputs of the all-ap Average Pooling layer. These are
                     optionally passed to the output layer.
         """
-        o1, o2 = self.attn(x1, x2) # shapes (batch_size, 2, max_length, input_size)
-        c1, c2 = self.conv(o1), self.conv(o2) # shapes (batch_size, 1, max_length + width - 1, output_size)
-        w1, w2 = self.pool(c1), self.pool(c2) # shapes (batch_size, 1, max_length, output_size)
-        w1, w2 = self.dropout(w1), self.dropout(w2)
-        a1, a2 = self.ap(c1), self.ap(c2) # shapes (batch_size, output_size)
+        o1, o2 = self.attn(x1, x2, lengths1, lengths2, attention_matrices) # shapes (batch_size, 2, max_length, input_size)
+        (w1, w2), (a1, a2) = siamese(self._conv_pool, o1, o2, self.batch_pairs, lengths1, lengths2)
         return w1, w2, a1, a2
+
+    def _conv_pool(self, o, lengths):
+        """ Computes the shared part of the forward pass for one side of the pairs.
+
+            Args:
+                o: torch.Tensor of shape (batch_size, 2, max_length, input_size)
+                    The output of the attention layer for one side of the pairs.
+                lengths: torch.LongTensor of shape (batch_size,) or None
+                    The true lengths of the sequences in o.
+
+            Returns:
+                w: torch.Tensor of shape (batch_size, 1, max_length, output_size)
+                    The output of the w-ap Average Pooling layer.
+                a: torch.Tensor of shape (batch_size, output_size)
+                    The output of the all-ap Average Pooling layer.
+        """
+        c = self.conv(o, lengths) # shape (batch_size, 1, max_length + width - 1, output_size)
+        w = self.dropout(self.pool(c, lengths)) # shape (batch_size, 1, max_length, output_size)
+        a = self.ap(c, self.conv.output_lengths(lengths)) # shape (batch_size, output_size)
+        return w, a
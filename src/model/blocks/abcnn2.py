@@ -4,6 +4,7 @@ import torch
 import torch.nn as nn
 
 from model.pooling.allap import AllAP
+from model.utils import siamese
 
 class ABCNN2Block(nn.Module):
     """ Implements a single ABCNN-2 block as described in this paper: 
@@ -11,19 +12,26 @@ class ABCNN2Block(nn.Module):
         http://www.aclweb.org/anthology/Q16-1019
     """
     
-    def __init__(self, conv, attn, dropout_rate=0.5):
+    def __init__(self, conv, attn, dropout_rate=0.5, batch_pairs=False):
         super().__init__()
         self.conv = conv
         self.attn = attn
         self.ap = AllAP()
         self.dropout = nn.Dropout2d(p=dropout_rate)
+        self.batch_pairs = batch_pairs
 
-    def forward(self, x1, x2):
+    def forward(self, x1, x2, lengths1=None, lengths2=None, attention_matrices=None):
         """ Computes the forward pass over the ABCNN-1 Block.
 
             Args:
                 x1, x2: torch.Tensors of shape (batch_size, 1, max_length, input_size)
                     The inputs to the ABCNN-1 Block.
+                lengths1, lengths2: torch.LongTensors of shape (batch_size,)
+                    Optional, the true lengths of the sequences in x1 and x2.
+                    If provided, then padding positions are masked out.
+                attention_matrices: dict
+                    Unused, since this Block has no attention over its inputs.
+                    Accepted so that a Layer can call all Blocks the same way.
 
             Returns:
                 w1, w2: torch.Tensors of shape (batch_size, 1, max_length, output_size)
@@ -33,8 +41,43 @@ class ABCNN2Block(nn.Module):
                     The outputs of the all-ap Average Pooling layer. These are
                     optionally passed to the output layer.
         """
-        c1, c2 = self.conv(x1), self.conv(x2)
-        w1, w2 = self.attn(c1, c2)
+        ((c1, c2),) = siamese(self._conv, x1, x2, self.batch_pairs, lengths1, lengths2)
+        return self.from_conv(c1, c2, lengths1, lengths2)
+
+    def from_conv(self, c1, c2, lengths1=None, lengths2=None):
+        """ Computes the rest of the forward pass over the ABCNN-2 Block from
+            the outputs of its convolutional layer. This lets a Layer compute
+            the convolutions of several Blocks at once.
+
+            Args:
+                c1, c2: torch.Tensors of shape (batch_size, 1, max_length + width - 1, output_size)
+                    The outputs of the convolutional layer for x1 and x2.
+                lengths1, lengths2: torch.LongTensors of shape (batch_size,)
+                    Optional, the true lengths of the sequences in x1 and x2.
+
+            Returns:
+                w1, w2, a1, a2: torch.Tensors
+                    The same outputs as the forward pass.
+        """
+        w1, w2 = self.attn(c1, c2, lengths1, lengths2)
         w1, w2 = self.dropout(w1), self.dropout(w2)
-        a1, a2 = self.ap(c1), self.ap(c2)
+        a1 = self.ap(c1, self.conv.output_lengths(lengths1))
+        a2 = self.ap(c2, self.conv.output_lengths(lengths2))
         return w1, w2, a1, a2
+
+    def _conv(self, x, lengths):
+        """ Computes the shared part of the forward pass for one side of the pairs.
+
+            Args:
+                x: torch.Tensor of shape (batch_size, 1, max_length, input_size)
+                    The input for one side of the pairs.
+                lengths: torch.LongTensor of shape (batch_size,) or None
+                    The true lengths of the sequences in x.
+
+            Returns:
+                outputs: tuple of (torch.Tensor,)
+                    The output of the convolutional layer, of shape
+                    (batch_size, 1, max_length + width - 1, output_size), as
+                    the only element of the tuple that siamese expects.
+        """
+        return (self.conv(x, lengths),)
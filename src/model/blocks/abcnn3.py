@@ -4,6 +4,7 @@ import torch
 import torch.nn as nn
 
 from model.pooling.allap import AllAP
+from model.utils import siamese
 
 class ABCNN3Block(nn.Module):
     """ Implements a single ABCNN-3 block as described in this paper: 
@@ -11,7 +12,7 @@ class ABCNN3Block(nn.Module):
         http://www.aclweb.org/anthology/Q16-1019
     """
     
-    def __init__(self, attn1, conv, attn2, dropout_rate=0.5):
+    def __init__(self, attn1, conv, attn2, dropout_rate=0.5, batch_pairs=False):
         """ Initializes the ABCNN-3 Block.
 
             Args:
@@ -22,6 +23,10 @@ class ABCNN3Block(nn.Module):
                 attn2: ABCNN2Attention Module
                     The attention mechanism used by the ABCNN-2 Block
                     (also called the attention-based average pooling layer).
+                batch_pairs: boolean
+                    Specifies whether to stack both sides of the pairs along
+                    the batch axis so the shared layers run once per forward
+                    pass.
                 
             Returns:
                 None
@@ -32,13 +37,21 @@ class ABCNN3Block(nn.Module):
         self.attn2 = attn2
         self.ap = AllAP()
         self.dropout = nn.Dropout2d(p=dropout_rate)
+        self.batch_pairs = batch_pairs
 
-    def forward(self, x1, x2):
+    def forward(self, x1, x2, lengths1=None, lengths2=None, attention_matrices=None):
         """ Computes the forward pass over the ABCNN-3 Block.
 
             Args:
                 x1, x2: torch.Tensors of shape (batch_size, 1, max_length, input_size)
                     The inputs to the ABCNN-3 Block.
+                lengths1, lengths2: torch.LongTensors of shape (batch_size,)
+                    Optional, the true lengths of the sequences in x1 and x2.
+                    If provided, then padding positions are masked out.
+                attention_matrices: dict
+                    Optional, a memo of the attention matrices computed for x1
+                    and x2 that is shared by the Blocks of a Layer during a
+                    single forward pass.
 
             Returns:
                 w1, w2: torch.Tensors of shape (batch_size, 1, max_length, output_size)
@@ -48,9 +61,28 @@ class ABCNN3Block(nn.Module):
                     The outputs of the all-ap average pooling layer. These are
                     optionally passed to the output layer.
         """
-        o1, o2 = self.attn1(x1, x2)
-        c1, c2 = self.conv(o1), self.conv(o2)
-        w1, w2 = self.attn2(c1, c2)
+        o1, o2 = self.attn1(x1, x2, lengths1, lengths2, attention_matrices)
+        (c1, c2), (a1, a2) = siamese(self._conv_ap, o1, o2, self.batch_pairs, lengths1, lengths2)
+        w1, w2 = self.attn2(c1, c2, lengths1, lengths2)
         w1, w2 = self.dropout(w1), self.dropout(w2)
-        a1, a2 = self.ap(c1), self.ap(c2)
         return w1, w2, a1, a2
+
+    def _conv_ap(self, o, lengths):
+        """ Computes the shared part of the forward pass for one side of the pairs.
+
+            Args:
+                o: torch.Tensor of shape (batch_size, 2, max_length, input_size)
+                    The output of the ABCNN-1 attention layer for one side of
+                    the pairs.
+                lengths: torch.LongTensor of shape (batch_size,) or None
+                    The true lengths of the sequences in o.
+
+            Returns:
+                c: torch.Tensor of shape (batch_size, 1, max_length + width - 1, output_size)
+                    The output of the convolutional layer.
+                a: torch.Tensor of shape (batch_size, output_size)
+                    The output of the all-ap Average Pooling layer.
+        """
+        c = self.conv(o, lengths)
+        a = self.ap(c, self.conv.output_lengths(lengths))
+        return c, a
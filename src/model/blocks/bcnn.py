@@ -4,6 +4,7 @@ import torch
 import torch.nn as nn
 
 from model.pooling.allap import AllAP
+from model.utils import siamese
 
 class BCNNBlock(nn.Module):
     """ Implements a single BCNN Block as described in this paper: 
@@ -11,7 +12,7 @@ class BCNNBlock(nn.Module):
         http://www.aclweb.org/anthology/Q16-1019
     """
 
-    def __init__(self, conv, pool, dropout_rate=0.5):
+    def __init__(self, conv, pool, dropout_rate=0.5, batch_pairs=False):
         """ Initializes the BCNN Block.
 
             Args:
@@ -19,6 +20,9 @@ class BCNNBlock(nn.Module):
                     The Convolution layer for the BCNN Block.
                 pool: Average Pooling module
                     The Average Pooling layer for the BCNN Block.
+                batch_pairs: boolean
+                    Specifies whether to stack x1 and x2 along the batch
+                    axis so the shared layers run once per forward pass.
 
             Returns:
                 None
@@ -28,13 +32,20 @@ class BCNNBlock(nn.Module):
         self.pool = pool
         self.ap = AllAP()
         self.dropout = nn.Dropout2d(p=dropout_rate)
+        self.batch_pairs = batch_pairs
 
-    def forward(self, x1, x2):
+    def forward(self, x1, x2, lengths1=None, lengths2=None, attention_matrices=None):
         """ Computes the forward pass over the BCNN Block.
             
             Args:
                 x1, x2: torch.Tensors of shape (batch_size, 1, max_length, input_size)
                     The inputs to the BCNN Block.
+                lengths1, lengths2: torch.LongTensors of shape (batch_size,)
+                    Optional, the true lengths of the sequences in x1 and x2.
+                    If provided, then padding positions are masked out.
+                attention_matrices: dict
+                    Unused, since this Block has no attention over its inputs.
+                    Accepted so that a Layer can call all Blocks the same way.
 
             Returns:
                 w1, w2: torch.Tensors of shape (batch_size, 1, max_length, output_size)
@@ -44,8 +55,60 @@ class BCNNBlock(nn.Module):
                     The outputs of the all-ap Average Pooling layer. These are optionally
                     passed to the output layer.
         """
-        c1, c2 = self.conv(x1), self.conv(x2)
-        w1, w2 = self.pool(c1), self.pool(c2)
-        w1, w2 = self.dropout(w1), self.dropout(w2)
-        a1, a2 = self.ap(c1), self.ap(c2)
+        (w1, w2), (a1, a2) = siamese(self._conv_pool, x1, x2, self.batch_pairs, lengths1, lengths2)
         return w1, w2, a1, a2
+
+    def from_conv(self, c1, c2, lengths1=None, lengths2=None):
+        """ Computes the rest of the forward pass over the BCNN Block from
+            the outputs of its convolutional layer. This lets a Layer compute
+            the convolutions of several Blocks at once.
+
+            Args:
+                c1, c2: torch.Tensors of shape (batch_size, 1, max_length + width - 1, output_size)
+                    The outputs of the convolutional layer for x1 and x2.
+                lengths1, lengths2: torch.LongTensors of shape (batch_size,)
+                    Optional, the true lengths of the sequences in x1 and x2.
+
+            Returns:
+                w1, w2, a1, a2: torch.Tensors
+                    The same outputs as the forward pass.
+        """
+        (w1, w2), (a1, a2) = siamese(self._pool, c1, c2, self.batch_pairs, lengths1, lengths2)
+        return w1, w2, a1, a2
+
+    def _conv_pool(self, x, lengths):
+        """ Computes the shared part of the forward pass for one side of the pairs.
+
+            Args:
+                x: torch.Tensor of shape (batch_size, 1, max_length, input_size)
+                    The input for one side of the pairs.
+                lengths: torch.LongTensor of shape (batch_size,) or None
+                    The true lengths of the sequences in x.
+
+            Returns:
+                w: torch.Tensor of shape (batch_size, 1, max_length, output_size)
+                    The output of the w-ap Average Pooling layer.
+                a: torch.Tensor of shape (batch_size, output_size)
+                    The output of the all-ap Average Pooling layer.
+        """
+        c = self.conv(x, lengths) # shape (batch_size, 1, max_length + width - 1, output_size)
+        return self._pool(c, lengths)
+
+    def _pool(self, c, lengths):
+        """ Computes the pooling part of the forward pass for one side of the pairs.
+
+            Args:
+                c: torch.Tensor of shape (batch_size, 1, max_length + width - 1, output_size)
+                    The output of the convolutional layer for one side of the pairs.
+                lengths: torch.LongTensor of shape (batch_size,) or None
+                    The true lengths of the sequences c was computed from.
+
+            Returns:
+                w: torch.Tensor of shape (batch_size, 1, max_length, output_size)
+                    The output of the w-ap Average Pooling layer.
+                a: torch.Tensor of shape (batch_size, output_size)
+                    The output of the all-ap Average Pooling layer.
+        """
+        w = self.dropout(self.pool(c, lengths)) # shape (batch_size, 1, max_length, output_size)
+        a = self.ap(c, self.conv.output_lengths(lengths)) # shape (batch_size, output_size)
+        return w, a
@@ -4,6 +4,9 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from model.utils import convolution_lengths
+from model.utils import mask_rows
+
 class Convolution(nn.Module):
     """ Implements the convolution layer as described in this paper:
 
@@ -26,6 +29,7 @@ class Convolution(nn.Module):
                 None
         """
         super().__init__()
+        self.width = width
         self.conv = \
             nn.Conv2d(
                 in_channels, 
@@ -35,12 +39,16 @@ class Convolution(nn.Module):
                 padding=(width - 1, 0)
             )
 
-    def forward(self, x):
+    def forward(self, x, lengths=None):
         """ Computes the forward pass over the convolution layer.
 
             Args:
                 x: torch.Tensor of shape (batch_size, 1, seq_len, height)
                     The input to the convolution layer.
+                lengths: torch.LongTensor of shape (batch_size,)
+                    Optional, the true lengths of the input sequences. If
+                    provided, then the output columns that only cover padding
+                    are set to 0.
 
             Returns:
                 out: torch.Tensor of shape (batch_size, 1, width, out_channels)
@@ -48,8 +56,61 @@ class Convolution(nn.Module):
         """
         out = F.tanh(self.conv(x)) # shape (batch_size, out_channels, width, 1) 
         out = out.permute(0, 3, 2, 1) # shape (batch_size, 1, width, out_channels)
-        return out
+        return mask_rows(out, self.output_lengths(lengths))
         
         # (64, 1, 20, 300)      convolution: in_channels = 1, out_channels = 50, height = 3, width = 300, stride = (1, 1), padding = (height - 1, 0)
         # ==> (64, 50, 22, 1)   tranpose: (0, 3, 2, 1)
         # ==> (64, 1, 22, 50)
+
+    def output_lengths(self, lengths):
+        """ Computes the number of output columns of the convolution layer that
+            cover at least one real (non-padding) input column.
+
+            Args:
+                lengths: torch.LongTensor of shape (batch_size,) or None
+                    The true lengths of the input sequences.
+
+            Returns:
+                lengths: torch.LongTensor of shape (batch_size,) or None
+                    The true lengths of the output sequences, or None if no
+                    input lengths were given.
+        """
+        return None if lengths is None else convolution_lengths(lengths, self.width)
+
+
+def fused_convolution(convs, x, lengths=None):
+    """ Computes the outputs of several convolution layers over the same input
+        with a single convolution. The kernels of the narrower layers are
+        zero-padded to the largest width and all kernels are stacked along the
+        output channels, so the layers share one large GEMM instead of each
+        running its own small one.
+
+        Args:
+            convs: list of Convolution modules
+                The convolution layers to fuse. They must all take the same
+                number of input channels and input features.
+            x: torch.Tensor of shape (batch_size, in_channels, max_length, input_size)
+                The input to every convolution layer.
+            lengths: torch.LongTensor of shape (batch_size,)
+                Optional, the true lengths of the input sequences.
+
+        Returns:
+            outputs: list of torch.Tensors of shape (batch_size, 1, max_length + width - 1, output_size)
+                The output of each convolution layer, in the order of convs.
+    """
+    max_width = max(conv.width for conv in convs)
+    weight = torch.cat([
+        F.pad(conv.conv.weight, (0, 0, max_width - conv.width, 0))
+        for conv in convs
+    ], dim=0) # shape (sum of output_size, in_channels, max_width, input_size)
+    bias = torch.cat([conv.conv.bias for conv in convs], dim=0)
+    out = torch.tanh(F.conv2d(x, weight, bias, padding=(max_width - 1, 0)))
+    out = out.permute(0, 3, 2, 1) # shape (batch_size, 1, max_length + max_width - 1, sum of output_size)
+
+    # Split the output back into the output of each layer
+    outputs = []
+    output_sizes = [conv.conv.out_channels for conv in convs]
+    for conv, c in zip(convs, torch.split(out, output_sizes, dim=3)):
+        c = c[:, :, :x.shape[2] + conv.width - 1]
+        outputs.append(mask_rows(c, conv.output_lengths(lengths)))
+    return outputs
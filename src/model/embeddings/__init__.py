@@ -0,0 +1 @@
+# Marks "embeddings" directory as a package.
\ No newline at end of file
@@ -2,8 +2,11 @@
 
 import torch
 import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
 
+from model.convolution.conv import fused_convolution
 from model.pooling.allap import AllAP
+from model.utils import siamese
 
 class CNNLayer(nn.Module):
     """ Extends on the single Block module concept described in this paper: 
@@ -15,15 +18,25 @@ class CNNLayer(nn.Module):
         followed by pooling layers with corresponding widths. The outputs of these
         pooling layers are combined to form the input to the following section of
         the network.
+
+        Blocks of the same type whose convolutional layers read the Layer's input
+        directly (BCNN and ABCNN-2 Blocks) have their convolutions fused into a
+        single wider convolution, and Blocks with the same attention over the
+        Layer's input (ABCNN-1 and ABCNN-3 Blocks with the same match-score)
+        compute the attention matrix once per forward pass.
     """
 
-    def __init__(self, blocks):
+    def __init__(self, blocks, checkpoint_blocks=False):
         """ Initializes the CNNLayer.
 
             Args:
                 blocks: list of Block modules
                     Contains Block modules with different window sizes and 
                     pooling widths.
+                checkpoint_blocks: boolean
+                    Specifies whether to discard the activations of each Block
+                    after the forward pass and recompute them during the
+                    backward pass, trading compute for memory.
 
             Returns:
                 None
@@ -31,13 +44,26 @@ class CNNLayer(nn.Module):
         super().__init__()
         self.blocks = nn.ModuleList(blocks)
         self.ap = AllAP()
+        self.checkpoint_blocks = checkpoint_blocks
+
+        # Group the Blocks whose convolutions can be fused
+        groups = {}
+        for index, block in enumerate(blocks):
+            if hasattr(block, "from_conv"):
+                conv = block.conv.conv
+                key = (type(block), conv.in_channels, conv.kernel_size[1], block.batch_pairs)
+                groups.setdefault(key, []).append(index)
+        self.fused_groups = [group for group in groups.values() if len(group) > 1]
         
-    def forward(self, x1, x2):
+    def forward(self, x1, x2, lengths1=None, lengths2=None):
         """ Computes the forward pass over the CNN Layer.
             
             Args:
                 x1, x2: torch.FloatTensors of shape (batch_size, 1, max_length, input_size)
                     The inputs to the CNN Block.
+                lengths1, lengths2: torch.LongTensors of shape (batch_size,)
+                    Optional, the true lengths of the sequences in x1 and x2.
+                    If provided, then padding positions are masked out.
 
             Returns:
                 w1, w2: torch.FloatTensors of shape (batch_size, 1, max_length, output_size)
@@ -52,9 +78,30 @@ class CNNLayer(nn.Module):
         wap1, wap2 = [], []
         allap1, allap2 = [], []
 
-        # Process inputs
-        for block in self.blocks:
-            w1, w2, a1, a2 = block(x1, x2)
+        # Compute the fused convolutions
+        conv_outputs = {}
+        for group in self.fused_groups:
+            convs = [self.blocks[index].conv for index in group]
+            outputs = siamese(
+                lambda x, lengths: fused_convolution(convs, x, lengths),
+                x1, x2, self.blocks[group[0]].batch_pairs, lengths1, lengths2
+            )
+            conv_outputs.update(zip(group, outputs))
+
+        # Process inputs, sharing the attention matrices computed for them.
+        # Checkpointed Blocks recompute their own attention matrices, since
+        # a shared one would be kept alive for the backward pass.
+        use_checkpoint = self.checkpoint_blocks and torch.is_grad_enabled()
+        attention_matrices = None if use_checkpoint else {}
+        for index, block in enumerate(self.blocks):
+            if index in conv_outputs:
+                fn, args = block.from_conv, conv_outputs[index] + (lengths1, lengths2)
+            else:
+                fn, args = block, (x1, x2, lengths1, lengths2, attention_matrices)
+            if use_checkpoint:
+                w1, w2, a1, a2 = checkpoint(fn, *args, use_reentrant=False)
+            else:
+                w1, w2, a1, a2 = fn(*args)
             wap1.append(w1)
             wap2.append(w2)
             allap1.append(a1)
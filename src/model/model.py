@@ -2,8 +2,11 @@
 
 import torch
 import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
 
 from model.pooling.allap import AllAP
+from model.utils import mask_rows
+from model.utils import siamese
 
 class Model(nn.Module):
     """ Extends on the model introduced in this paper:
@@ -16,11 +19,17 @@ class Model(nn.Module):
         and then these outputs are stacked and fed into the next layer.
     """
 
-    def __init__(self, embeddings, layers, use_all_layers, final_size):
+    def __init__(self,
+                 embeddings,
+                 layers,
+                 use_all_layers,
+                 final_size,
+                 batch_pairs=False,
+                 checkpoint_layers=False):
         """ Initialize the ABCNN model layers.
 
             Args:
-                embeddings: nn.Embedding Module
+                embeddings: nn.Embedding or QuantizedEmbedding Module
                     The embeddings matrix.
                 layers: list of Layers modules
                     Contains the Layers of the CNN.
@@ -31,6 +40,14 @@ class Model(nn.Module):
                 final_size: int
                     The number of inputs in the final fully connected layer
                     (accounts for both outputs from x1 and x2).
+                batch_pairs: boolean
+                    Specifies whether to stack both questions of each pair
+                    along the batch axis so the embedding lookup runs once
+                    per forward pass.
+                checkpoint_layers: boolean
+                    Specifies whether to discard the activations of each Layer
+                    after the forward pass and recompute them during the
+                    backward pass, trading compute for memory.
 
             Returns:
                 None
@@ -41,16 +58,23 @@ class Model(nn.Module):
         self.use_all_layers = use_all_layers
         self.fc = nn.Linear(final_size, 2)
         self.ap = AllAP()
+        self.batch_pairs = batch_pairs
+        self.checkpoint_layers = checkpoint_layers
 
-
-    def extract_features(self, inputs):
+    def extract_features(self, inputs, lengths=None):
         """ Computes the feature vectors for each query-query pair in the
             batch that would be passed along to the final fully connected
             layer.
 
+            If the true lengths of the questions are given, then the batch is
+            trimmed to its longest question and padding positions are masked
+            out, so the features do not depend on how much padding was used.
+
             Args:
-                inputs: torch.LongTensors of shape (batch_size, 2, max_length)
+                inputs: torch integer Tensor of shape (batch_size, 2, max_length)
                     The initial tokenized inputs for a batch of question pairs.
+                lengths: torch integer Tensor of shape (batch_size, 2)
+                    Optional, the true lengths of the questions in each pair.
 
             Returns:
                 outputs: torch.FloatTensors of shape (batch_size, output_size)
@@ -61,19 +85,29 @@ class Model(nn.Module):
         outputs1 = []
         outputs2 = []
 
-        # Extract the initial sequences
-        x1 = self.embeddings(inputs[:, 0, :]).unsqueeze(1)
-        x2 = self.embeddings(inputs[:, 1, :]).unsqueeze(1)
-
-        # Store all-ap outputs for input layer
-        a1 = self.ap(x1) 
-        a2 = self.ap(x2) # shapes (batch_size, embeddings_size)
+        # Trim the batch to its longest question
+        lengths1 = lengths2 = None
+        if lengths is not None:
+            max_length = max(int(lengths.max()), 1)
+            inputs = inputs[:, :, :max_length]
+            lengths = lengths.long()
+            lengths1, lengths2 = lengths[:, 0], lengths[:, 1]
+
+        # Extract the initial sequences and the all-ap outputs for the input layer
+        (x1, x2), (a1, a2) = \
+            siamese(self._embed, inputs[:, 0, :], inputs[:, 1, :], self.batch_pairs,
+                lengths1, lengths2)
         outputs1.append(a1)
         outputs2.append(a2)
 
         # Process input through blocks
+        use_checkpoint = self.checkpoint_layers and torch.is_grad_enabled()
         for layer in self.layers:
-            x1, x2, a1, a2 = layer(x1, x2)
+            if use_checkpoint:
+                x1, x2, a1, a2 = \
+                    checkpoint(layer, x1, x2, lengths1, lengths2, use_reentrant=False)
+            else:
+                x1, x2, a1, a2 = layer(x1, x2, lengths1, lengths2)
             outputs1.append(a1)
             outputs1.append(a2)
 
@@ -85,18 +119,40 @@ class Model(nn.Module):
 
         return outputs
 
-    def forward(self, inputs):
+    def forward(self, inputs, lengths=None):
         """ Computes the forward pass over the network.
 
             Args:
-                inputs: torch.LongTensors of shape (batch_size, 2, max_length)
+                inputs: torch integer Tensor of shape (batch_size, 2, max_length)
                     The initial tokenized inputs for a batch of question pairs.
+                lengths: torch integer Tensor of shape (batch_size, 2)
+                    Optional, the true lengths of the questions in each pair.
 
             Returns:
                 outputs: torch.FloatTensor of shape (batch_size, 2)
                     The scores for each class for each pair of sequences.
         """
-        outputs = self.extract_features(inputs)
+        outputs = self.extract_features(inputs, lengths)
         logits = self.fc(outputs)
         return logits
 
+    def _embed(self, inputs, lengths):
+        """ Embeds one side of a batch of question pairs.
+
+            Args:
+                inputs: torch integer Tensor of shape (batch_size, max_length)
+                    The tokenized inputs for one question of each pair.
+                lengths: torch.LongTensor of shape (batch_size,) or None
+                    The true lengths of the questions.
+
+            Returns:
+                x: torch.FloatTensor of shape (batch_size, 1, max_length, embeddings_size)
+                    The embedded sequences.
+                a: torch.FloatTensor of shape (batch_size, embeddings_size)
+                    The output of the all-ap layer over the embedded sequences.
+        """
+        # Compactly stored word indices are only widened for the lookup
+        x = mask_rows(self.embeddings(inputs.long()).unsqueeze(1), lengths)
+        a = self.ap(x, lengths)
+        return x, a
+
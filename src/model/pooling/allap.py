@@ -4,6 +4,8 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from model.utils import mask_rows
+
 class AllAP(nn.Module):
     """ Implements the Average Pooling layer over all columns (all-ap) of a 
         feature map as described in this paper:
@@ -11,17 +13,26 @@ class AllAP(nn.Module):
         http://www.aclweb.org/anthology/Q16-1019
     """
 
-    def forward(self, x):
+    def forward(self, x, lengths=None):
         """ Computes the forward pass over the all-ap layer.
 
             Args:
                 x: torch.Tensor of shape (batch_size, 1, max_length + width - 1, height)
                     The output of the convolution layer.
+                lengths: torch.LongTensor of shape (batch_size,)
+                    Optional, the number of real (non-padding) columns in
+                    each feature map. If provided, then only these columns
+                    are averaged.
 
             Returns:
                 out: torch.Tensor of shape (batch_size, height)
                     The output of the all-ap layer.
         """
+        if lengths is not None:
+            out = torch.sum(mask_rows(x, lengths), dim=2) # shape (batch_size, 1, height)
+            out = out / lengths.clamp(min=1).to(x.dtype).view(-1, 1, 1)
+            return torch.squeeze(out, dim=1) # shape (batch_size, height)
+
         pool_width = x.shape[2]
         out = F.avg_pool2d(x, (pool_width, 1)) # shape (batch_size, 1, 1, height)
         out = torch.squeeze(out, dim=2) # shape (batch_size, 1, height)
@@ -3,6 +3,8 @@
 import torch
 import torch.nn as nn
 
+from model.utils import mask_rows
+
 class WidthAP(nn.Module):
     """ Implements the Average Pooling layer over windows of w columns (w-ap) 
         of a feature map as described in this paper:
@@ -23,15 +25,18 @@ class WidthAP(nn.Module):
         super().__init__()
         self.wp = nn.AvgPool2d((width, 1), stride=1)
 
-    def forward(self, x):
+    def forward(self, x, lengths=None):
         """ Implements the forward pass over the w-ap layer. 
         
             Args:
                 x: torch.Tensor of shape (batch_size, 1, max_length + width - 1, height)
                     The output of the convolution layer.
+                lengths: torch.LongTensor of shape (batch_size,)
+                    Optional, the true lengths of the sequences. If provided,
+                    then the output columns past each length are set to 0.
 
             Returns:
                 out: torch.Tensor of shape (batch_size, 1, max_length, height)
                     The output of the w-ap layer.
         """
-        return self.wp(x)
+        return mask_rows(self.wp(x), lengths)
@@ -0,0 +1,88 @@
+# coding=utf-8
+
+import torch
+
+def siamese(fn, x1, x2, batch_pairs, lengths1=None, lengths2=None):
+    """ Applies the same function to both sides of a batch of pairs.
+
+        When batch_pairs is set, the two sides are stacked along the batch
+        axis so that every shared-weight operation in fn runs once over a
+        batch twice as large instead of twice over the original batch.
+
+        Args:
+            fn: function
+                Maps a torch.Tensor and its sequence lengths (or None) to a
+                tuple of torch.Tensors whose first dimension is the batch
+                dimension.
+            x1, x2: torch.Tensors of shape (batch_size, ...)
+                The two sides of the batch of pairs.
+            batch_pairs: boolean
+                Specifies whether to stack both sides into a single call.
+            lengths1, lengths2: torch.LongTensors of shape (batch_size,)
+                Optional, the true lengths of the sequences in x1 and x2.
+
+        Returns:
+            outputs: tuple of (torch.Tensor, torch.Tensor)
+                For each output of fn, the results for x1 and x2.
+    """
+    if batch_pairs:
+        lengths = None if lengths1 is None else torch.cat([lengths1, lengths2], dim=0)
+        outputs = fn(torch.cat([x1, x2], dim=0), lengths)
+        return tuple(torch.chunk(output, 2, dim=0) for output in outputs)
+    return tuple(zip(fn(x1, lengths1), fn(x2, lengths2)))
+
+
+def convolution_lengths(lengths, width):
+    """ Computes the number of output columns of a wide convolution that
+        cover at least one real (non-padding) input column. An empty sequence
+        has no such columns, so all of its output columns are masked.
+
+        Args:
+            lengths: torch.LongTensor of shape (batch_size,)
+                The true lengths of the input sequences.
+            width: int
+                The width of the convolution filters.
+
+        Returns:
+            lengths: torch.LongTensor of shape (batch_size,)
+                The true lengths of the output sequences.
+    """
+    return (lengths + width - 1) * (lengths > 0).long()
+
+
+def sequence_mask(lengths, max_length):
+    """ Computes which positions of a batch of padded sequences are real
+        (non-padding) positions.
+
+        Args:
+            lengths: torch.LongTensor of shape (batch_size,)
+                The true lengths of the sequences.
+            max_length: int
+                The padded length of the sequences.
+
+        Returns:
+            mask: torch.BoolTensor of shape (batch_size, max_length)
+                True at every position less than the sequence's length.
+    """
+    positions = torch.arange(max_length, device=lengths.device)
+    return positions.unsqueeze(0) < lengths.unsqueeze(1)
+
+
+def mask_rows(x, lengths):
+    """ Zeroes out the padding rows of a batch of feature maps.
+
+        Args:
+            x: torch.Tensor of shape (batch_size, channels, max_length, size)
+                The batch of feature maps.
+            lengths: torch.LongTensor of shape (batch_size,) or None
+                The number of real rows in each feature map. If None, then
+                x is returned unchanged.
+
+        Returns:
+            x: torch.Tensor of shape (batch_size, channels, max_length, size)
+                The feature maps with every row past its length set to 0.
+    """
+    if lengths is None:
+        return x
+    mask = sequence_mask(lengths, x.shape[2])
+    return x.masked_fill(~mask[:, None, :, None], 0)
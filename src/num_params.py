@@ -19,7 +19,7 @@ args = parser.parse_args()
 
 # Setup the model
 config = read_config(args.config_file)
-_, model = setup(config)
+_, _, _, model = setup(config)
 if args.freeze:
     print("Freezing weights of CNN layers.")
     model = freeze_weights(model)
@@ -0,0 +1,48 @@
+# coding=utf-8
+
+import json
+import torch
+
+def load_exported_model(filepath, map_location="cpu"):
+    """ Loads an ABCNN model exported with export.py. Only torch is needed
+        to run the loaded model.
+
+        Args:
+            filepath: string
+                The path to the exported model.
+            map_location: string
+                The device to load the model onto.
+
+        Returns:
+            model: torch.jit.ScriptModule
+                The exported model. It is called as model(inputs, lengths),
+                where inputs is a LongTensor of shape (batch_size, 2, max_length)
+                and lengths is a LongTensor of shape (batch_size, 2), and
+                returns the scores for each class with shape (batch_size, 2).
+            max_length: int
+                The length that every question must be padded to.
+    """
+    extra_files = {"metadata.json": ""}
+    model = torch.jit.load(filepath, map_location=map_location, _extra_files=extra_files)
+    metadata = json.loads(extra_files["metadata.json"])
+    return model.eval(), metadata["max_length"]
+
+
+def predict(model, inputs, lengths):
+    """ Computes the scores of an exported ABCNN model for a batch of question
+        pairs.
+
+        Args:
+            model: torch.jit.ScriptModule
+                The exported model.
+            inputs: torch.LongTensor of shape (batch_size, 2, max_length)
+                The tokenized inputs for a batch of question pairs.
+            lengths: torch.LongTensor of shape (batch_size, 2)
+                The true lengths of the questions in each pair.
+
+        Returns:
+            scores: torch.FloatTensor of shape (batch_size, 2)
+                The scores for each class for each pair of questions.
+    """
+    with torch.no_grad():
+        return model(inputs, lengths)
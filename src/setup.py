@@ -1,5 +1,7 @@
 # coding=utf-8
 
+import collections
+import concurrent.futures
 import numpy as np
 import os
 import pandas as pd
@@ -8,8 +10,8 @@ import torch
 import torch.nn as nn
 import yaml
 from gensim.models import KeyedVectors
-from gensim.models import FastText
-from nltk.corpus import stopwords
+from gensim.models.fasttext import ft_ngram_hashes
+from gensim.models.fasttext import load_facebook_vectors
 from tqdm import tqdm
 
 from model.attention.abcnn1 import ABCNN1Attention
@@ -19,10 +21,36 @@ from model.blocks.abcnn2 import ABCNN2Block
 from model.blocks.abcnn3 import ABCNN3Block
 from model.blocks.bcnn import BCNNBlock
 from model.convolution.conv import Convolution
+from model.embeddings.quantized import QuantizedEmbedding
 from model.model import Model
 from model.layers.layer import CNNLayer
 from model.pooling.allap import AllAP
 from model.pooling.widthap import WidthAP
+from dataset_cache import GrowableArray
+from dataset_cache import array_path
+from dataset_cache import cache_entry
+from dataset_cache import compact_dtype
+from dataset_cache import dataset_cache_key
+from dataset_cache import embeddings_cache_key
+from dataset_cache import load_datasets
+from dataset_cache import load_word_vectors
+from dataset_cache import save_datasets
+from dataset_cache import save_word_vectors
+from tokenizer import OOV_BUCKET_PREFIX
+from tokenizer import QuestionIndexer
+from tokenizer import Tokenizer
+from tokenizer import english_stop_words
+from tokenizer import prune_vocabulary
+from tokenizer import vocabulary_settings
+
+# The number of question pairs that are tokenized together
+INDEX_CHUNK_SIZE = 10000
+
+# The number of rows of the embedding matrix that are initialized at a time
+EMBEDDING_BLOCK_ROWS = 2 ** 16
+
+# The number of out-of-vocabulary words whose FastText vectors are computed together
+OOV_BATCH_SIZE = 4096
 
 class EmbeddingFormatError(Exception):
     """ Raised when an unrecognized embedding format is specified. """
@@ -34,6 +62,11 @@ class BlockTypeError(Exception):
     pass
 
 
+class CheckpointModeError(Exception):
+    """ Raised when an unrecognized activation checkpointing mode is specified. """
+    pass
+
+
 def read_config(config_path):
     """ Reads in the configuration file from the given path.
 
@@ -48,7 +81,7 @@ def read_config(config_path):
                 details.
     """
     with open(config_path, "r") as stream:
-        config = yaml.load(stream)
+        config = yaml.safe_load(stream)
         return config
 
 def setup(config):
@@ -63,7 +96,12 @@ def setup(config):
             features: dict
                 Contains the feature maps for the query-query pairs in each
                 dataset. The keys are the names of the datasets and the values
-                are the Tensors storing the feature maps.
+                are the Tensors storing the feature maps, in the narrowest
+                integer type that fits the vocabulary.
+            lengths: dict
+                Contains the true (unpadded) lengths of the questions in each
+                dataset. The keys are the names of the datasets and the values
+                are the Tensors storing the lengths.
             labels: dict
                 Contains the labels for the query-query pairs in each dataset.
                 The keys are the names of the datasetsa nd the values are the
@@ -73,10 +111,10 @@ def setup(config):
             optimizer: optimizer
                 The optimization algorithm to use for training.
     """
-    features, labels, word2index = setup_datasets(config)
+    features, lengths, labels, word2index = setup_datasets(config)
     embeddings = setup_embeddings(config, word2index)
     model = setup_model(config, embeddings)
-    return features, labels, model
+    return features, lengths, labels, model
 
 
 def setup_model(config, embeddings):
@@ -102,12 +140,22 @@ def setup_model(config, embeddings):
     max_length = config["max_length"]
     layer_configs = config["layers"]
     use_all_layer_outputs = config["use_all_layer_outputs"]
+    batch_pairs = config.get("batch_pairs", False)
+    checkpoint_activations = config.get("checkpoint_activations", None)
+    if checkpoint_activations not in [None, "layer", "block"]:
+        raise CheckpointModeError
     
     # Initialize the layers
     layers = []
     layer_sizes = [embeddings_size]
     for layer_config in layer_configs:
-        layer, layer_size = setup_layer(max_length, layer_config)
+        layer, layer_size = \
+            setup_layer(
+                max_length,
+                layer_config,
+                batch_pairs=batch_pairs,
+                checkpoint_blocks=checkpoint_activations == "block"
+            )
         layers.append(layer)
         layer_sizes.append(layer_size)
 
@@ -115,7 +163,14 @@ def setup_model(config, embeddings):
     final_size = 2 * sum(layer_sizes) if use_all_layer_outputs else 2 * layer_sizes[-1]
 
     # Put it all together
-    model = Model(embeddings, layers, use_all_layer_outputs, final_size).float()
+    model = Model(
+        embeddings,
+        layers,
+        use_all_layer_outputs,
+        final_size,
+        batch_pairs=batch_pairs,
+        checkpoint_layers=checkpoint_activations == "layer"
+    ).float()
     model.apply(weights_init)
     return model
 
@@ -149,13 +204,43 @@ def setup_word_vectors(config):
             return KeyedVectors.load_word2vec_format(embeddings_path, binary=is_binary)
         elif embeddings_format == "fasttext":
             print("Loading FastText word vectors from: {}".format(embeddings_path))
-            return FastText.load_fasttext_format(embeddings_path).wv
+            return load_facebook_vectors(embeddings_path)
         else:
-            raise EmbeddingsFormatError
+            raise EmbeddingFormatError
     return None
 
 
 def setup_datasets(config):
+    """ Converts the examples from the datasets into a machine-readable format
+        useful for training. If a cache directory is configured, then the
+        tokenized datasets are loaded from it when the data files, maximum
+        length and tokenizer are unchanged, and saved to it otherwise.
+
+        Args:
+            config: dict
+                Contains the information needed to initialize the datasets.
+
+        Returns:
+            features, lengths, labels, word2index. See tokenize_datasets.
+    """
+    cache_dir = config.get("dataset_cache_dir", None)
+    if cache_dir is None:
+        return tokenize_datasets(config)
+
+    directory = os.path.join(cache_dir, dataset_cache_key(config))
+    datasets = load_datasets(directory)
+    if datasets is not None:
+        print("Loaded the tokenized datasets from: {}".format(directory))
+        return datasets
+
+    # Stream the tokenized datasets straight into the new cache entry
+    with cache_entry(directory) as temp_directory:
+        save_datasets(temp_directory, *tokenize_datasets(config, directory=temp_directory))
+    print("Saved the tokenized datasets to: {}".format(directory))
+    return load_datasets(directory)
+
+
+def tokenize_datasets(config, directory=None):
     """ Converts the examples from the datasets into a machine-readable format
         useful for training.
 
@@ -165,84 +250,260 @@ def setup_datasets(config):
         when it sees a word that is OOV.) OOV words are assigned random word 
         embeddings.
 
+        The CSV files are streamed in chunks of pairs, which are tokenized by a
+        pool of worker processes shared by every dataset. Each worker indexes
+        its chunks with its own vocabulary. The main process then maps those
+        indices to the global vocabulary one chunk at a time, in the order of
+        the datasets and examples, and appends them to arrays that grow as
+        needed. The word indices are stored in int32 while the vocabulary
+        grows, and converted to the narrowest type that fits it at the end.
+        A word is added to the global vocabulary in the first chunk
+        that it appears in, in the order that it first appears in that chunk,
+        so the word IDs are the same as those of a serial run for any number
+        of workers.
+
+        If min_count or max_vocab is set, then the occurrences of each word
+        are counted as the chunks are indexed, and the vocabulary is pruned
+        with prune_vocabulary once every dataset is read. The word indices are
+        mapped to the pruned vocabulary while they are narrowed.
+
         Args:
             config: dict
                 Contains the information needed to initialize the datasets.
+            directory: string or None
+                The directory to write the arrays to as memory-mapped files
+                (see array_path in dataset_cache.py), so that datasets larger
+                than memory can be tokenized. If None, then the arrays are kept
+                in memory.
 
         Returns:
-            features: dict of string to LongTensor
-                Maps each dataset name to its tokenized examples.
+            features: dict of string to integer Tensor
+                Maps each dataset name to its tokenized examples, stored in
+                the narrowest integer type that fits the vocabulary.
+            lengths: dict of string to integer Tensor
+                Maps each dataset name to the true lengths of the questions
+                in its examples, with shape (num_examples, 2), stored in the
+                narrowest integer type that fits max_length.
             labels: dict of string to LongTensor
                 Maps each dataset name to its labels.
             word2index: dict of string to int
                 Maps each word to a unique integer ID.
     """
     word2index = {"<PAD>": 0}
+    pruning = vocabulary_settings(config)
     question_cols = ["question1", "question2"]
-    examples = {} # Contains the featurized examples for each dataset
-    labels = {} # Contains the labels for each dataset
-    # texts = {} # Contains the parsed text for each dataset
-
-    # Process each dataset
     max_length = config["max_length"]
     data_paths = config["data_paths"]
-    datasets = {name: pd.read_csv(path) for name, path in data_paths.items()}
-    for name, dataset in datasets.items():
-        
-        # Process texts
-        classes = []
-        indexed_examples = []
-        # parsed_texts = []
-        num_examples = len(dataset)
-        for index, example in tqdm(dataset.iterrows(), desc=name, total=num_examples):
-
-            # Process each question separately
-            index_map = []
-            parsed_text = []
-            for column in question_cols:
-
-                # Parse and clean the text
-                question = example[column]
-                words = text_to_word_list(question)
-                words = remove_stop_words(words)
-
-                # Convert words to indices
-                indexes = []
-                for word in words:
-
-                    # Update word-index lookup if necessary
-                    if word not in word2index:
-                        word2index[word] = len(word2index)
-                    
-                    # Add the word's index to the list
-                    indexes.append(word2index[word])
-
-                # Truncate if necessary
-                length = min(len(indexes), max_length)
-                indexes = indexes[:length]
-                words = words[:length]
-
-                # Pad if necessary
-                if length < max_length:
-                    num_padding = max_length - length
-                    indexes.extend([0] * num_padding)
-                    words.extend(["<PAD>"] * num_padding)
-    
-                # Store parsed text and index tensors
-                index_map.append(indexes)
-                # parsed_text.append(words)
 
-            # Store processed text and index tensor map and label
-            classes.append(example["is_duplicate"])
-            indexed_examples.append(index_map)
-            # parsed_texts.append(parsed_text)
+    # Allocate the growable arrays of each dataset
+    arrays = {}
+    for i, name in enumerate(data_paths):
+        row_types = {
+            "examples": ((len(question_cols), max_length), np.int32),
+            "lengths": ((len(question_cols),), compact_dtype(max_length)),
+            "labels": ((), np.int64)
+        }
+        arrays[name] = {
+            kind: GrowableArray(
+                row_shape,
+                dtype,
+                path=None if directory is None else array_path(directory, i, kind)
+            )
+            for kind, (row_shape, dtype) in row_types.items()
+        }
+
+    # Questions are tokenized and indexed once per worker, even across datasets
+    num_workers = config.get("preprocessing_workers", 1)
+    worker_args = (max_length, config.get("question_cache_size", None))
+    if num_workers > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            num_workers,
+            initializer=_init_index_worker,
+            initargs=worker_args
+        )
+    else:
+        executor = None
+        _init_index_worker(*worker_args)
+
+    def index_chunks():
+        """ Yields the name, labels and indexed questions of every chunk in
+            order, keeping a bounded number of chunks in flight.
+        """
+        pending = collections.deque()
+        for name, questions, classes in _read_chunks(data_paths, question_cols):
+            if executor is None:
+                yield name, classes, _index_chunk(questions)
+                continue
+            pending.append((name, classes, executor.submit(_index_chunk, questions)))
+            if len(pending) > 2 * num_workers:
+                name, classes, future = pending.popleft()
+                yield name, classes, future.result()
+        for name, classes, future in pending:
+            yield name, classes, future.result()
+
+    # Map each worker's word indices to the global vocabulary
+    worker_vocabs = {} # Maps each worker to the global IDs of its words
+    hits = misses = miss_seconds = 0
+    counts = np.zeros(1, dtype=np.int64)
+    progress = tqdm(desc="datasets", unit=" pairs")
+    for name, classes, result in index_chunks():
+        worker, new_words, indexes, question_lengths, stats = result
+        new_ids = [word2index.setdefault(word, len(word2index)) for word in new_words]
+        vocab = worker_vocabs.get(worker, np.zeros(1, dtype=np.int32)) # <PAD> is 0 everywhere
+        vocab = worker_vocabs[worker] = np.concatenate([vocab, np.array(new_ids, dtype=np.int32)])
+        chunk_examples = vocab[indexes].reshape(-1, len(question_cols), max_length)
+        arrays[name]["examples"].append(chunk_examples)
+        if pruning is not None:
+            # Only the chunk's distinct words are counted, and counts grows
+            # geometrically, so each chunk costs O(chunk) rather than O(vocab)
+            if len(counts) < len(word2index):
+                grown = np.zeros(max(2 * len(counts), len(word2index)), dtype=np.int64)
+                grown[:len(counts)] = counts
+                counts = grown
+            ids, id_counts = np.unique(chunk_examples, return_counts=True)
+            counts[ids] += id_counts
+        arrays[name]["lengths"].append(question_lengths.reshape(-1, len(question_cols)))
+        arrays[name]["labels"].append(classes)
+        hits, misses, miss_seconds = hits + stats[0], misses + stats[1], miss_seconds + stats[2]
+        progress.update(len(classes))
+    progress.close()
+    if executor is not None:
+        executor.shutdown()
+
+    # Keep the frequent words and hash the rest into the OOV buckets
+    lookup = None
+    if pruning is not None:
+        num_words = len(word2index)
+        counts = counts[:num_words]
+        word2index, lookup = prune_vocabulary(word2index, counts, **pruning)
+        report_vocabulary(config, num_words, word2index, counts, lookup)
+
+    # Save the processed result, narrowing the word indices to fit the vocabulary
+    index_dtype = compact_dtype(len(word2index) - 1)
+    examples = {
+        name: torch.from_numpy(arrays[name]["examples"].finish(index_dtype, lookup=lookup))
+        for name in data_paths
+    }
+    lengths = {name: torch.from_numpy(arrays[name]["lengths"].finish()) for name in data_paths}
+    labels = {name: torch.from_numpy(arrays[name]["labels"].finish()) for name in data_paths}
+
+    lookups = hits + misses
+    print("Question cache: {:.1%} hit rate over {} questions, ~{:.1f}s saved".format(
+        hits / lookups if lookups else 0.0, lookups, hits * miss_seconds / misses if misses else 0.0))
+    return examples, lengths, labels, word2index
+
+
+def report_vocabulary(config, num_words, word2index, counts, lookup):
+    """ Prints how much a pruned vocabulary saves over the full vocabulary.
+
+        Args:
+            config: dict
+                Contains the information needed to initialize the datasets.
+            num_words: int
+                The size of the full vocabulary, including padding.
+            word2index: dict of string to int
+                The pruned vocabulary.
+            counts: np.ndarray of int64 with shape (num_words,)
+                The number of times that each word of the full vocabulary
+                occurs in the datasets.
+            lookup: np.ndarray of int64 with shape (num_words,)
+                Maps the full vocabulary to the pruned vocabulary.
+
+        Returns:
+            None
+    """
+    num_buckets = sum(word.startswith(OOV_BUCKET_PREFIX) for word in word2index)
+    num_kept = len(word2index) - 1 - num_buckets
+    is_kept = (lookup > 0) & (lookup <= num_kept)
+    total = counts[1:].sum()
+    coverage = counts[is_kept].sum() / total if total else 1.0
+
+    # Embedding matrices have one more row than the vocabulary, in float32
+    row_bytes = 4 * config["embeddings"]["size"]
+    print("Vocabulary: kept {} of {} words covering {:.1%} of tokens, {} words hashed into {} OOV buckets".format(
+        num_kept, num_words - 1, coverage, num_words - 1 - num_kept, num_buckets))
+    print("Embedding matrix: {:.1f} MB -> {:.1f} MB".format(
+        (num_words + 1) * row_bytes / 2 ** 20, (len(word2index) + 1) * row_bytes / 2 ** 20))
+
+
+def _read_chunks(data_paths, question_cols):
+    """ Streams the datasets from their CSV files in chunks of pairs.
+
+        Args:
+            data_paths: dict of string to string
+                Maps each dataset name to its CSV file.
+            question_cols: list of string
+                The columns that hold the questions of each pair.
+
+        Yields:
+            name: string
+                The name of the dataset.
+            questions: list of string
+                The questions of the chunk's pairs, keeping the order of the
+                questions within each pair so that word IDs are assigned as
+                they are read.
+            classes: np.ndarray of int64
+                The labels of the chunk's pairs.
+    """
+    for name, path in data_paths.items():
+        reader = pd.read_csv(
+            path,
+            usecols=question_cols + ["is_duplicate"],
+            dtype={column: str for column in question_cols},
+            chunksize=INDEX_CHUNK_SIZE
+        )
+        for chunk in reader:
+            columns = [chunk[column].tolist() for column in question_cols]
+            questions = [str(question) for pair in zip(*columns) for question in pair]
+            yield name, questions, chunk["is_duplicate"].to_numpy(dtype=np.int64)
+
+
+def _init_index_worker(max_length, cache_size):
+    """ Creates the question indexer of a preprocessing worker, which keeps
+        its vocabulary and intern table across the chunks that it indexes.
+
+        Args:
+            max_length: int
+                The length to truncate or pad the questions to.
+            cache_size: int or None
+                The maximum number of questions to keep in the intern table.
+
+        Returns:
+            None
+    """
+    global _worker_indexer
+    _worker_indexer = QuestionIndexer(Tokenizer(), {"<PAD>": 0}, max_length, max_size=cache_size)
+
 
-        # Save the processed result
-        labels[name] = torch.LongTensor(classes)
-        examples[name] = torch.LongTensor(indexed_examples)
-        # texts[name] = parsed_texts
+def _index_chunk(questions):
+    """ Indexes a chunk of questions with the vocabulary of this worker.
 
-    return examples, labels, word2index
+        Args:
+            questions: list of string
+                The raw questions to index.
+
+        Returns:
+            worker: int
+                The ID of this worker's process.
+            new_words: list of string
+                The words added to this worker's vocabulary by this chunk, in
+                the order that they first appear.
+            indexes: np.ndarray of int64 with shape (num_questions, max_length)
+                The padded word indices of the questions in this worker's
+                vocabulary.
+            lengths: np.ndarray of int64 with shape (num_questions,)
+                The true lengths of the questions.
+            stats: tuple of (int, int, float)
+                The intern table hits, misses and seconds spent on misses.
+    """
+    indexer = _worker_indexer
+    num_words = len(indexer.words)
+    hits, misses, miss_seconds = indexer.hits, indexer.misses, indexer.miss_seconds
+    indexed = indexer(questions)
+    indexes = np.array([row for row, _ in indexed], dtype=np.int64).reshape(-1, indexer.max_length)
+    lengths = np.array([length for _, length in indexed], dtype=np.int64)
+    stats = (indexer.hits - hits, indexer.misses - misses, indexer.miss_seconds - miss_seconds)
+    return os.getpid(), indexer.words[num_words:], indexes, lengths, stats
 
 
 def setup_embeddings(config, word2index):
@@ -256,31 +517,150 @@ def setup_embeddings(config, word2index):
                 Maps words to indices in the embedding matrix.
 
         Returns
-            embeddings: nn.Embedding
-                The embedding matrix.
+            embeddings: nn.Embedding or QuantizedEmbedding
+                The embedding matrix. If the embeddings config sets quantize,
+                then the matrix is stored in int8 with per-row scales.
     """
-    # Initialize random word embeddings
+    # Initialize random word embeddings in float32, drawing them in blocks of
+    # rows so that only one block of float64 draws exists at a time
     embeddings_size = config["embeddings"]["size"]
-    embeddings = np.random.uniform(-0.01, 0.01, (len(word2index) + 1, embeddings_size))
+    num_embeddings = len(word2index) + 1
+    embeddings = np.empty((num_embeddings, embeddings_size), dtype=np.float32)
+    for start in range(0, num_embeddings, EMBEDDING_BLOCK_ROWS):
+        end = min(start + EMBEDDING_BLOCK_ROWS, num_embeddings)
+        embeddings[start:end] = np.random.uniform(-0.01, 0.01, (end - start, embeddings_size))
     embeddings[0] = 0   # Padding is just all 0s
 
     # Replace random vectors with pre-trained vectors if available
-    word_vectors = setup_word_vectors(config)
-    if word_vectors:
-        for word, index in tqdm(word2index.items(), desc="embedding matrix"):
-            if word in word_vectors:
-                embeddings[index] = word_vectors[word]
+    pretrained = setup_pretrained_vectors(config, word2index)
+    if pretrained is not None:
+        rows, vectors = pretrained
+        embeddings[rows] = vectors
 
     # Convert to nn.Embedding
     embeddings = nn.Embedding.from_pretrained(torch.from_numpy(embeddings))
+    if config["embeddings"].get("quantize", False):
+        embeddings = quantize_embeddings(embeddings)
     return embeddings
+
+
+def quantize_embeddings(embeddings):
+    """ Quantizes an embedding matrix to int8 with per-row scales, printing
+        how much memory it saves and how far the rows move.
+
+        Args:
+            embeddings: nn.Embedding
+                The fp32 embedding matrix.
+
+        Returns:
+            quantized: QuantizedEmbedding
+                The quantized embedding matrix.
+    """
+    quantized = QuantizedEmbedding.from_float(embeddings)
+    fp32_bytes = embeddings.weight.nelement() * embeddings.weight.element_size()
+    int8_bytes = sum(buffer.nelement() * buffer.element_size() for buffer in quantized.buffers())
+    max_error = torch.max(torch.abs(quantized.dequantize() - embeddings.weight)).item()
+    print("Quantized embedding matrix: {:.1f} MB -> {:.1f} MB, max error {:.2e}".format(
+        fp32_bytes / 2 ** 20, int8_bytes / 2 ** 20, max_error))
+    return quantized
     
 
+def lookup_word_vectors(word2index, word_vectors):
+    """ Finds the pre-trained vectors of the vocabulary. The words are looked
+        up in the index of the word vectors all at once, and their vectors are
+        gathered with a single fancy index. FastText vectors of
+        out-of-vocabulary words are computed from their character ngrams in
+        batches, averaging the ngram vectors like gensim does. Padding is
+        skipped so that it keeps its all-0 vector, as are the OOV buckets of a
+        pruned vocabulary so that they keep their random vectors.
+
+        Args:
+            word2index: dict
+                Maps words to indices in the embedding matrix.
+            word_vectors: KeyedVectors or FastTextKeyedVectors
+                The pretrained word embeddings.
+
+        Returns:
+            rows: np.ndarray of int64 with shape (num_vectors,)
+                The rows of the embedding matrix that have pre-trained vectors.
+            vectors: np.ndarray of float32 with shape (num_vectors, embeddings_size)
+                The pre-trained vectors for those rows.
+    """
+    words = [
+        word for word in word2index
+        if word != "<PAD>" and not word.startswith(OOV_BUCKET_PREFIX)
+    ]
+    rows = np.array([word2index[word] for word in words], dtype=np.int64)
+    key_to_index = word_vectors.key_to_index
+    indices = np.array([key_to_index.get(word, -1) for word in words], dtype=np.int64)
+    found = indices >= 0
+    vectors = [word_vectors.vectors[indices[found]].astype(np.float32, copy=False)]
+
+    # Only FastText vectors with character ngrams have out-of-vocabulary vectors
+    if getattr(word_vectors, "bucket", 0) == 0:
+        return rows[found], vectors[0]
+    oov_words = [word for word, index in zip(words, indices) if index < 0]
+    for start in tqdm(range(0, len(oov_words), OOV_BATCH_SIZE), desc="oov vectors"):
+        batch = oov_words[start:start + OOV_BATCH_SIZE]
+        hashes = [
+            ft_ngram_hashes(word, word_vectors.min_n, word_vectors.max_n, word_vectors.bucket)
+            for word in batch
+        ]
+        counts = np.array([len(word_hashes) for word_hashes in hashes], dtype=np.int64)
+        ngrams = word_vectors.vectors_ngrams[np.concatenate(hashes).astype(np.int64)]
+
+        # Words without any ngrams get the all-0 vector, as in gensim
+        batch_vectors = np.zeros((len(batch), word_vectors.vector_size), dtype=np.float32)
+        has_ngrams = counts > 0
+        offsets = np.cumsum(counts) - counts
+        sums = np.add.reduceat(ngrams, offsets[has_ngrams], axis=0) if len(ngrams) else ngrams
+        batch_vectors[has_ngrams] = sums / counts[has_ngrams, None]
+        vectors.append(batch_vectors)
+    return np.concatenate([rows[found], rows[~found]]), np.concatenate(vectors)
+
+
+def setup_pretrained_vectors(config, word2index):
+    """ Finds the pre-trained vectors of the vocabulary. If a cache directory
+        is configured for the embeddings, then the vectors are loaded from it
+        without loading the word embeddings when the embeddings file and the
+        vocabulary are unchanged, and saved to it otherwise.
+
+        Args:
+            config: dict
+                Contains the information needed to initialize the embeddings.
+            word2index: dict
+                Maps words to indices in the embedding matrix.
+
+        Returns:
+            rows, vectors, or None if no pre-trained word embeddings are
+            available. See lookup_word_vectors.
+    """
+    cache_dir = config["embeddings"].get("cache_dir", None)
+    if cache_dir is None or not os.path.isfile(config["embeddings"]["path"]):
+        word_vectors = setup_word_vectors(config)
+        return lookup_word_vectors(word2index, word_vectors) if word_vectors else None
+
+    directory = os.path.join(cache_dir, embeddings_cache_key(config, word2index))
+    pretrained = load_word_vectors(directory)
+    if pretrained is not None:
+        print("Loaded the pre-trained vectors of the vocabulary from: {}".format(directory))
+        return pretrained
+
+    pretrained = lookup_word_vectors(word2index, setup_word_vectors(config))
+    with cache_entry(directory) as temp_directory:
+        save_word_vectors(temp_directory, *pretrained)
+    print("Saved the pre-trained vectors of the vocabulary to: {}".format(directory))
+    return pretrained
+
+
 def text_to_word_list(text):
     """ Preprocess and convert texts to a list of words. This code was taken 
         from Elior Cohen's MaLSTM code, which can be found here:
 
         https://github.com/eliorc/Medium/blob/master/MaLSTM.ipynb
+
+        This is the reference implementation for Tokenizer in tokenizer.py,
+        which produces the same words in a few passes over the text.
         
          Args:
              text: string
@@ -340,11 +720,11 @@ def remove_stop_words(words):
             words: list of string
                 The words in the text with stop words removed.
     """
-    stops = set(stopwords.words("english"))
+    stops = english_stop_words()
     return list(filter(lambda w: w not in stops, words))
 
 
-def setup_layer(max_length, layer_config):
+def setup_layer(max_length, layer_config, batch_pairs=False, checkpoint_blocks=False):
     """ Creates a single Layer for the CNN model.
 
         Args:
@@ -352,6 +732,12 @@ def setup_layer(max_length, layer_config):
                 The maximum length of the input sequences.
             layer_config: dict
                 Contains the information needed to create the layer.
+            batch_pairs: boolean
+                Specifies whether the blocks should stack both questions of
+                each pair into a single batch for their shared layers.
+            checkpoint_blocks: boolean
+                Specifies whether the layer should recompute the activations
+                of its blocks during the backward pass instead of storing them.
 
         Returns:
             layer: Layer module
@@ -360,15 +746,15 @@ def setup_layer(max_length, layer_config):
     blocks = []
     output_sizes = []
     for block_config in layer_config:
-        block, output_size = setup_block(max_length, block_config)
+        block, output_size = setup_block(max_length, block_config, batch_pairs=batch_pairs)
         blocks.append(block)
         output_sizes.append(output_size)
-    layer = CNNLayer(blocks)
+    layer = CNNLayer(blocks, checkpoint_blocks=checkpoint_blocks)
     layer_size = sum(output_sizes)
     return layer, layer_size
 
 
-def setup_block(max_length, block_config):
+def setup_block(max_length, block_config, batch_pairs=False):
     """ Creates a single block for the CNN model.
 
         Args:
@@ -376,6 +762,9 @@ def setup_block(max_length, block_config):
                 The maximum length for each sequence/question.
             block_config: dict
                 Contains the information needed to create the block.
+            batch_pairs: boolean
+                Specifies whether the block should stack both questions of
+                each pair into a single batch for its shared layers.
 
         Returns:
             block: Block module
@@ -391,24 +780,24 @@ def setup_block(max_length, block_config):
     if block_config["type"] == "bcnn":
         conv = Convolution(input_size, output_size, width, 1)
         pool = WidthAP(width)
-        block = BCNNBlock(conv, pool, dropout_rate=dropout_rate)
+        block = BCNNBlock(conv, pool, dropout_rate=dropout_rate, batch_pairs=batch_pairs)
     
     elif block_config["type"] == "abcnn1":
         attn = ABCNN1Attention(input_size, max_length, share_weights, match_score)
         conv = Convolution(input_size, output_size, width, 2)
         pool = WidthAP(width)
-        block = ABCNN1Block(attn, conv, pool, dropout_rate=dropout_rate)
+        block = ABCNN1Block(attn, conv, pool, dropout_rate=dropout_rate, batch_pairs=batch_pairs)
     
     elif block_config["type"] == "abcnn2":
         conv = Convolution(input_size, output_size, width, 1)
         attn = ABCNN2Attention(max_length, width, match_score)
-        block = ABCNN2Block(conv, attn, dropout_rate=dropout_rate)
+        block = ABCNN2Block(conv, attn, dropout_rate=dropout_rate, batch_pairs=batch_pairs)
     
     elif block_config["type"] == "abcnn3":
         attn1 = ABCNN1Attention(input_size, max_length, share_weights, match_score)
         conv = Convolution(input_size, output_size, width, 2)
         attn2 = ABCNN2Attention(max_length, width, match_score)
-        block = ABCNN3Block(attn1, conv, attn2, dropout_rate=dropout_rate)
+        block = ABCNN3Block(attn1, conv, attn2, dropout_rate=dropout_rate, batch_pairs=batch_pairs)
 
     else:
         raise BlockTypeError
@@ -437,4 +826,5 @@ def weights_init(m):
         nn.init.constant_(m.bias, 0)
     elif classname.find("ABCNN1Attention") != -1:
         nn.init.xavier_normal_(m.W1)
-        nn.init.xavier_normal_(m.W2)
+        if m.W2 is not None:
+            nn.init.xavier_normal_(m.W2)
@@ -0,0 +1,342 @@
+# coding=utf-8
+
+import collections
+import functools
+import numpy as np
+import re
+import time
+import warnings
+import zlib
+
+from nltk.corpus import stopwords
+
+# Bump whenever the words produced by the tokenizer change, which invalidates
+# the cached datasets
+VERSION = 1
+
+# Characters that are kept by the cleaning step. Note that "+-=" is a range,
+# so ":", ";", "<" and the digits are kept as well.
+DISALLOWED_PATTERN = re.compile(r"[^A-Za-z0-9^,!.\/'+-=]")
+
+# The cleaning step as a byte translation table. Non-ASCII characters are
+# encoded as "?" first, which is then replaced like any other unsupported
+# character.
+ASCII_TABLE = bytes(
+    ord(" ") if DISALLOWED_PATTERN.match(chr(i)) else i for i in range(256)
+)
+
+# Separates the texts of a column that are cleaned together. The texts
+# cannot affect each other since no rule after the cleaning step matches or
+# produces a separator, so the cleaning step is the only one that needs to
+# keep it.
+SEPARATOR = "\n"
+COLUMN_TABLE = bytes(
+    ord(SEPARATOR) if i == ord(SEPARATOR) else c for i, c in enumerate(ASCII_TABLE)
+)
+
+# Literal replacements, in the order that text_to_word_list applies them
+# before and after expanding thousands
+REPLACEMENTS = [
+    ("what's", "what is "),
+    ("'s", " "),
+    ("'ve", " have "),
+    ("can't", "cannot "),
+    ("n't", " not "),
+    ("i'm", "i am "),
+    ("'re", " are "),
+    ("'d", " would "),
+    ("'ll", " will "),
+    (",", " "),
+    (".", " "),
+    ("!", " ! "),
+    ("/", " "),
+    ("^", " ^ "),
+    ("+", " + "),
+    ("-", " - "),
+    ("=", " = "),
+    ("'", " "),
+]
+SPACING_REPLACEMENTS = [
+    (":", " : "),
+    (" e g ", " eg "),
+    (" b g ", " bg "),
+    (" u s ", " american "),
+    (" 9 11 ", "911"),
+    ("e - mail", "email"),
+    ("j k", "jk"),
+]
+
+# Every "k" that follows a digit, which is what r"(\d+)(k)" matches
+THOUSANDS_PATTERN = re.compile(r"(?<=\d)k")
+
+# The words of the hashed out-of-vocabulary buckets. The tokenizer lowercases
+# everything and removes "_" and ">", so these never collide with real words.
+OOV_BUCKET_PREFIX = "<OOV_"
+OOV_BUCKET = OOV_BUCKET_PREFIX + "{}>"
+
+
+@functools.lru_cache(maxsize=None)
+def english_stop_words():
+    """ Loads the NLTK English stop words once and caches them.
+
+        Returns:
+            stop_words: frozenset of string
+                The English stop words.
+    """
+    return frozenset(stopwords.words("english"))
+
+
+class Tokenizer(object):
+    """ Converts texts to lists of words with stop words removed.
+
+        Produces exactly the same words as remove_stop_words(text_to_word_list(text))
+        in setup.py with precompiled rules instead of a chain of re.sub calls:
+
+            1. The unsupported characters are replaced with one byte
+               translation table.
+            2. The literal rules are applied in order with str.replace, which
+               finds the same non-overlapping matches as re.sub.
+            3. Thousands are expanded with one compiled pattern ("5k" -> "5000").
+
+        The r"\0s" rule is dropped since the cleaning step already removes
+        NUL characters, as is the final whitespace collapse since str.split
+        already ignores runs of whitespace. The stop words are loaded once.
+
+        Args:
+            stop_words: iterable of string or None
+                The words to remove. If None, then the NLTK English stop words
+                are used.
+    """
+
+    def __init__(self, stop_words=None):
+        if stop_words is None:
+            self.stop_words = english_stop_words()
+        else:
+            self.stop_words = frozenset(stop_words)
+
+    def __call__(self, text):
+        """ Tokenizes a single text.
+
+            Args:
+                text: string
+                    The text to parse.
+
+            Returns:
+                words: list of string
+                    The parsed text with stop words removed.
+        """
+        return self._remove_stop_words(self.clean(str(text), ASCII_TABLE))
+
+    def tokenize_column(self, column):
+        """ Tokenizes a whole column of texts at once. The texts are joined
+            into a single string so that every rule makes one pass over the
+            whole column instead of one call per text.
+
+            Args:
+                column: pd.Series or sequence of string
+                    The texts to parse.
+
+            Returns:
+                words: list of list of string
+                    The parsed texts with stop words removed, in order.
+        """
+        texts = [str(text) for text in column]
+        if not texts:
+            return []
+        joined = SEPARATOR.join(texts)
+        if joined.count(SEPARATOR) != len(texts) - 1:
+            # The cleaning step would turn these separators into spaces anyway
+            joined = SEPARATOR.join(text.replace(SEPARATOR, " ") for text in texts)
+        cleaned = self.clean(joined, COLUMN_TABLE).split(SEPARATOR)
+        return [self._remove_stop_words(text) for text in cleaned]
+
+    def clean(self, text, table=ASCII_TABLE):
+        """ Normalizes a text so that splitting it on whitespace gives the
+            words of text_to_word_list.
+
+            Args:
+                text: string
+                    The text to clean.
+                table: bytes
+                    The translation table for the cleaning step.
+
+            Returns:
+                text: string
+                    The cleaned text.
+        """
+        text = text.lower().encode("ascii", "replace").translate(table).decode("ascii")
+        for old, new in REPLACEMENTS:
+            text = text.replace(old, new)
+        text = THOUSANDS_PATTERN.sub("000", text)
+        for old, new in SPACING_REPLACEMENTS:
+            text = text.replace(old, new)
+        return text
+
+    def _remove_stop_words(self, text):
+        stop_words = self.stop_words
+        return [word for word in text.split() if word not in stop_words]
+
+
+class QuestionIndexer(object):
+    """ Converts questions to padded lists of word indices, tokenizing and
+        indexing each distinct question only once. The results are kept in an
+        intern table keyed by the raw question text, which is reused for every
+        pair that the question appears in.
+
+        Repeated questions never add words to the vocabulary, so the word
+        indices are the same as when every question is indexed on its own.
+
+        Args:
+            tokenizer: Tokenizer
+                Converts the questions to lists of words.
+            word2index: dict of string to int
+                Maps each word to a unique integer ID. New words are added to
+                it, and to the list of words, in the order that they are seen.
+            max_length: int
+                The length to truncate or pad the questions to.
+            max_size: int or None
+                The maximum number of questions to keep in the intern table,
+                evicting the least recently used ones first. If None, then
+                every distinct question is kept.
+    """
+
+    def __init__(self, tokenizer, word2index, max_length, max_size=None):
+        self.tokenizer = tokenizer
+        self.word2index = word2index
+        self.words = list(word2index)
+        self.max_length = max_length
+        self.max_size = max_size
+        self.table = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.miss_seconds = 0.0
+
+    def __call__(self, questions):
+        """ Indexes a batch of questions, tokenizing the distinct questions
+            that are not in the intern table together.
+
+            Args:
+                questions: list of string
+                    The raw questions, in the order that their words should be
+                    added to the vocabulary.
+
+            Returns:
+                indexed: list of (list of int, int)
+                    The padded word indices and the true length of each
+                    question.
+        """
+        start = time.perf_counter()
+        missing = [question for question in dict.fromkeys(questions) if question not in self.table]
+        words = dict(zip(missing, self.tokenizer.tokenize_column(missing)))
+        self.miss_seconds += time.perf_counter() - start
+
+        indexed = []
+        for question in questions:
+            if question in self.table:
+                self.hits += 1
+                self.table.move_to_end(question)
+                indexed.append(self.table[question])
+                continue
+
+            # The question was either never seen or evicted by this batch
+            start = time.perf_counter()
+            self.misses += 1
+            question_words = words[question] if question in words else self.tokenizer(question)
+            row = self._index(question_words)
+            self.table[question] = row
+            if self.max_size is not None and len(self.table) > self.max_size:
+                self.table.popitem(last=False)
+            indexed.append(row)
+            self.miss_seconds += time.perf_counter() - start
+        return indexed
+
+    def _index(self, words):
+        indexes = []
+        for word in words:
+            if word not in self.word2index:
+                self.word2index[word] = len(self.word2index)
+                self.words.append(word)
+            indexes.append(self.word2index[word])
+
+        # Truncate and pad
+        length = min(len(indexes), self.max_length)
+        indexes = indexes[:length] + [0] * (self.max_length - length)
+        return indexes, length
+
+
+def vocabulary_settings(config):
+    """ Reads the vocabulary pruning settings from a config.
+
+        Args:
+            config: dict
+                Contains the information needed to initialize the datasets.
+
+        Returns:
+            settings: dict or None
+                The min_count, max_vocab and oov_buckets to prune the
+                vocabulary with, or None if every word is kept.
+    """
+    min_count = config.get("min_count", 1)
+    max_vocab = config.get("max_vocab", None)
+    if min_count <= 1 and max_vocab is None:
+        return None
+    return {
+        "min_count": min_count,
+        "max_vocab": max_vocab,
+        "oov_buckets": config.get("oov_buckets", 1)
+    }
+
+
+def prune_vocabulary(word2index, counts, min_count=1, max_vocab=None, oov_buckets=1):
+    """ Keeps the frequent words of a vocabulary and hashes the rest into a
+        fixed number of out-of-vocabulary buckets. The kept words are sorted
+        by decreasing frequency, breaking ties by their original order, so
+        the most used rows of the embedding matrix are next to each other.
+        Each pruned word is assigned a bucket by a CRC32 of its bytes, which
+        is the same in every process and run.
+
+        Args:
+            word2index: dict of string to int
+                Maps each word to a unique integer ID, with "<PAD>" as 0.
+            counts: np.ndarray of int64 with shape (len(word2index),)
+                The number of times that each word ID occurs in the datasets.
+            min_count: int
+                The minimum number of occurrences of a kept word.
+            max_vocab: int or None
+                The maximum number of kept words, not counting padding and
+                the buckets. If None, then every frequent word is kept.
+            oov_buckets: int
+                The number of buckets to hash the pruned words into. It is
+                capped at the number of pruned words (but kept at least 1),
+                so that pruning never grows the vocabulary.
+
+        Returns:
+            word2index: dict of string to int
+                The pruned vocabulary, with "<PAD>" as 0, then the kept words
+                and then the buckets.
+            lookup: np.ndarray of int64 with shape (len(word2index),)
+                Maps each original word ID to its ID in the pruned vocabulary.
+    """
+    if oov_buckets < 1:
+        raise ValueError("oov_buckets must be at least 1, got {}".format(oov_buckets))
+    words = sorted(word2index, key=word2index.get)
+    ids = np.arange(1, len(words))
+    ids = ids[counts[1:] >= min_count]
+    ids = ids[np.argsort(-counts[ids], kind="stable")][:max_vocab]
+
+    lookup = np.empty(len(words), dtype=np.int64)
+    lookup[0] = 0
+    lookup[ids] = np.arange(1, len(ids) + 1)
+    is_pruned = np.ones(len(words), dtype=bool)
+    is_pruned[0] = False
+    is_pruned[ids] = False
+    pruned_ids = np.flatnonzero(is_pruned)
+    if oov_buckets > max(len(pruned_ids), 1):
+        warnings.warn("Only {} words were pruned, using {} OOV buckets instead of {}".format(
+            len(pruned_ids), max(len(pruned_ids), 1), oov_buckets))
+        oov_buckets = max(len(pruned_ids), 1)
+    for i in pruned_ids:
+        lookup[i] = len(ids) + 1 + zlib.crc32(words[i].encode("utf-8")) % oov_buckets
+
+    pruned = ["<PAD>"] + [words[i] for i in ids] + [OOV_BUCKET.format(i) for i in range(oov_buckets)]
+    return {word: index for index, word in enumerate(pruned)}, lookup
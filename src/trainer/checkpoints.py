@@ -0,0 +1,157 @@
+# coding=utf-8
+
+import concurrent.futures
+import copy
+import os
+import tempfile
+import torch
+
+from trainer.snapshot import trainable_state_dict
+
+# The umask can only be read by setting it, which is not safe on the
+# background thread that writes checkpoints, so it is read once on import
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def checkpoint_state(model, optimizer, history, include_frozen=False):
+    """ Copies the state to save in a checkpoint to the CPU, so that training
+        can keep updating the model and optimizer while it is written.
+
+        Args:
+            model: torch.nn.Module
+                Defines the model.
+            optimizer: torch.optim.optimizer
+                Defines the optimizer.
+            history: dict
+                Contains histories of desired run metrics.
+            include_frozen: bool
+                Specifies whether to save the frozen state of the model, such
+                as the embedding matrix, and the optimizer state of its frozen
+                parameters. By default only the trainable state is saved (see
+                trainable_state_dict), which can be loaded back into the
+                model's full state_dict.
+
+        Returns:
+            state: tuple of (dict, dict, dict)
+                The state of the model, the state of the optimizer and the
+                history as a plain dict.
+    """
+    model_state = model.state_dict() if include_frozen else trainable_state_dict(model)
+    optimizer_state = optimizer.state_dict()
+    if not include_frozen:
+        # The optimizer state is keyed by the position of each parameter
+        params = [param for group in optimizer.param_groups for param in group["params"]]
+        optimizer_state["state"] = {
+            index: param_state for index, param_state in optimizer_state["state"].items()
+            if params[index].requires_grad
+        }
+
+    # A plain dict of lists can be loaded with torch.load(weights_only=True)
+    history = {name: copy.deepcopy(list(values)) for name, values in history.items()}
+    return _copy_to_cpu(model_state), _copy_to_cpu(optimizer_state), history
+
+
+def write_checkpoint(state, filepath):
+    """ Saves the state of a checkpoint to a file atomically. The state is
+        written to a temporary file in the same directory, which then replaces
+        the checkpoint file, so the file is never left partially written.
+
+        Args:
+            state: tuple
+                The output of checkpoint_state.
+            filepath: string
+                The path where the checkpoint file will be saved.
+
+        Returns:
+            None
+    """
+    directory = os.path.dirname(os.path.abspath(filepath))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(filepath) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as stream:
+            torch.save(state, stream)
+            stream.flush()
+            os.fsync(stream.fileno())
+
+        # mkstemp creates owner-only files, but checkpoints follow the umask
+        os.chmod(temp_path, 0o666 & ~_UMASK)
+        os.replace(temp_path, filepath)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class CheckpointWriter(object):
+    """ Saves checkpoints on a background thread. The state is copied to the
+        CPU on the training thread, and serialized and written by the
+        background thread while training continues. Checkpoints are written
+        one at a time in order, and at most one is pending: saving a
+        checkpoint first waits for the previous one to be written.
+    """
+
+    def __init__(self, include_frozen=False):
+        """ Initializes the CheckpointWriter.
+
+            Args:
+                include_frozen: bool
+                    Specifies whether to save the frozen state of the model.
+                    See checkpoint_state.
+
+            Returns:
+                None
+        """
+        self.include_frozen = include_frozen
+        self._executor = concurrent.futures.ThreadPoolExecutor(1)
+        self._pending = None
+
+    def save(self, model, optimizer, history, filepath):
+        """ Starts saving a checkpoint of the model.
+
+            Args:
+                model: torch.nn.Module
+                    Defines the model.
+                optimizer: torch.optim.optimizer
+                    Defines the optimizer.
+                history: dict
+                    Contains histories of desired run metrics.
+                filepath: string
+                    The path where the checkpoint file will be saved.
+
+            Returns:
+                None
+        """
+        self.wait()
+        state = checkpoint_state(model, optimizer, history, include_frozen=self.include_frozen)
+        self._pending = self._executor.submit(write_checkpoint, state, filepath)
+
+    def wait(self):
+        """ Waits for the pending checkpoint to be written, raising any error
+            that writing it raised.
+
+            Returns:
+                None
+        """
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            pending.result()
+
+    def close(self):
+        """ Waits for the pending checkpoint and stops the background thread.
+
+            Returns:
+                None
+        """
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown()
+
+
+def _copy_to_cpu(state):
+    if torch.is_tensor(state):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, dict):
+        return {key: _copy_to_cpu(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(_copy_to_cpu(value) for value in state)
+    return copy.deepcopy(state)
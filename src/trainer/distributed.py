@@ -0,0 +1,151 @@
+# coding=utf-8
+
+import inspect
+import os
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import Sampler
+
+def init_distributed():
+    """ Joins the process group of a data-parallel run launched with
+        torchrun (or any launcher that sets the RANK, WORLD_SIZE, MASTER_ADDR
+        and MASTER_PORT environment variables), using the gloo backend so
+        that the processes can train on the CPU. Does nothing when there is
+        only one process.
+
+        Returns:
+            rank: int
+                The rank of this process.
+            world_size: int
+                The number of processes.
+    """
+    world_size = int(os.environ.get("WORLD_SIZE", 1))
+    if world_size > 1 and not dist.is_initialized():
+        dist.init_process_group("gloo")
+    return get_rank(), get_world_size()
+
+
+def get_rank():
+    """ Returns the rank of this process, or 0 if it is not part of a
+        process group.
+    """
+    return dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+
+
+def get_world_size():
+    """ Returns the number of processes in the process group, or 1 if this
+        process is not part of one.
+    """
+    return dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+
+
+def all_gather(obj):
+    """ Gathers a picklable object from every process.
+
+        Args:
+            obj: object
+                The object of this process.
+
+        Returns:
+            objs: list of object
+                The objects of every process, in the order of their ranks.
+    """
+    if get_world_size() == 1:
+        return [obj]
+    objs = [None] * get_world_size()
+    dist.all_gather_object(objs, obj)
+    return objs
+
+
+
+def wrap_model(model):
+    """ Wraps a model for data-parallel training, copying its parameters and
+        buffers from the process of rank 0 to every other process. Buffers
+        (such as the int8 matrix of a QuantizedEmbedding) do not change during
+        training, so they are only copied here rather than before every
+        forward pass.
+
+        Args:
+            model: torch.nn.Module
+                The model to wrap.
+
+        Returns:
+            model: DistributedDataParallel
+                The wrapped model, which all-reduces the gradients.
+    """
+    for buffer in model.buffers():
+        dist.broadcast(buffer, 0)
+
+    # broadcast_buffers is deprecated in favour of forward_sync_buffers
+    parameters = inspect.signature(DistributedDataParallel).parameters
+    if "forward_sync_buffers" in parameters:
+        return DistributedDataParallel(model, forward_sync_buffers=False)
+    return DistributedDataParallel(model, broadcast_buffers=False)
+
+
+class ShardedBatchSampler(Sampler):
+    """ Splits the batches of a batch sampler between the processes of a
+        data-parallel run. Every process must iterate over the same batches
+        in the same order, so any shuffling has to use the same seed in every
+        process.
+
+        When padding, the batches are repeated from the start until every
+        process gets the same number of batches, which keeps the gradient
+        all-reduces of the processes in step. A repeated batch is always the
+        last batch of a process, and num_real_batches tells how many come
+        before it, so that it can be left out of the metrics. Otherwise each process gets a
+        contiguous range of batches, so that concatenating the outputs of
+        the processes in rank order gives the outputs in the original order.
+    """
+
+    def __init__(self, batch_sampler, rank, world_size, pad=True):
+        """ Initializes the ShardedBatchSampler.
+
+            Args:
+                batch_sampler: iterable of list of int
+                    Yields the indices of the examples in each batch.
+                rank: int
+                    The rank of this process.
+                world_size: int
+                    The number of processes.
+                pad: bool
+                    Specifies whether to give every process the same number
+                    of batches by repeating batches.
+
+            Returns:
+                None
+        """
+        self.batch_sampler = batch_sampler
+        self.rank = rank
+        self.world_size = world_size
+        self.pad = pad
+
+    def __iter__(self):
+        batches = list(self.batch_sampler)
+        if not self.pad:
+            start = len(batches) * self.rank // self.world_size
+            end = len(batches) * (self.rank + 1) // self.world_size
+            return iter(batches[start:end])
+        num_padded = -len(batches) % self.world_size
+        batches = batches + (batches * self.world_size)[:num_padded]
+        return iter(batches[self.rank::self.world_size])
+
+    def __len__(self):
+        num_batches = len(self.batch_sampler)
+        if not self.pad:
+            return num_batches * (self.rank + 1) // self.world_size - num_batches * self.rank // self.world_size
+        return (num_batches + self.world_size - 1) // self.world_size
+
+    def num_real_batches(self):
+        """ Counts the batches of this process that are not repeated for
+            padding, which come before any repeated batch.
+
+            Returns:
+                num_batches: int
+                    The number of batches of this process that are not
+                    padding.
+        """
+        num_batches = len(self.batch_sampler)
+        if not self.pad:
+            return len(self)
+        return len(range(self.rank, num_batches, self.world_size))
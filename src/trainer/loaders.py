@@ -0,0 +1,100 @@
+# coding=utf-8
+
+import collections
+import torch
+
+class TensorBatchLoader(object):
+    """ Iterates over batches of a dataset whose tensors are all resident in
+        memory, such as a TensorDataset. Each batch is gathered from every
+        tensor with a single index_select, instead of indexing the examples
+        one at a time and collating them like a DataLoader does, so no worker
+        processes are needed.
+
+        When the examples are visited in order, each batch is a view of the
+        tensors instead of a copy.
+
+        Batches can be gathered ahead of time by a thread pool, which keeps
+        running across epochs and overlaps the gathering with the forward and
+        backward passes (index_select releases the GIL).
+    """
+
+    def __init__(self,
+                 tensors,
+                 batch_size,
+                 batch_sampler=None,
+                 shuffle=False,
+                 pin_memory=False,
+                 executor=None,
+                 prefetch=2):
+        """ Initializes the TensorBatchLoader.
+
+            Args:
+                tensors: list of torch.Tensors
+                    The tensors of the dataset, which all have the examples
+                    along their first dimension.
+                batch_size: int
+                    The number of examples per batch.
+                batch_sampler: Sampler
+                    Optional, yields the indices of the examples in each
+                    batch. If given, then batch_size and shuffle are ignored.
+                shuffle: bool
+                    Specifies whether to visit the examples in a random order.
+                pin_memory: bool
+                    Specifies whether to gather the batches into page-locked
+                    memory so that they can be copied to a GPU asynchronously.
+                    Ignored when CUDA is not available.
+                executor: concurrent.futures.Executor
+                    Optional, the thread pool that gathers the batches. If
+                    None, then each batch is gathered when it is needed.
+                prefetch: int
+                    The number of batches to gather ahead of time when an
+                    executor is given.
+
+            Returns:
+                None
+        """
+        self.tensors = tensors
+        self.batch_size = batch_size
+        self.batch_sampler = batch_sampler
+        self.shuffle = shuffle
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.executor = executor
+        self.prefetch = prefetch
+
+    def __iter__(self):
+        batches = iter(self._batch_indices())
+        if self.executor is None:
+            for indices in batches:
+                yield self._gather(indices)
+            return
+
+        # Keep a bounded number of batches in flight
+        pending = collections.deque()
+        for indices in batches:
+            pending.append(self.executor.submit(self._gather, indices))
+            if len(pending) > self.prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def __len__(self):
+        if self.batch_sampler is not None:
+            return len(self.batch_sampler)
+        return (len(self.tensors[0]) + self.batch_size - 1) // self.batch_size
+
+    def _batch_indices(self):
+        if self.batch_sampler is not None:
+            return (torch.as_tensor(batch, dtype=torch.long) for batch in self.batch_sampler)
+        num_examples = len(self.tensors[0])
+        if self.shuffle:
+            return torch.split(torch.randperm(num_examples), self.batch_size)
+        return (slice(start, start + self.batch_size) for start in range(0, num_examples, self.batch_size))
+
+    def _gather(self, indices):
+        if isinstance(indices, slice):
+            batch = [tensor[indices] for tensor in self.tensors]
+        else:
+            batch = [tensor.index_select(0, indices) for tensor in self.tensors]
+        if self.pin_memory:
+            batch = [tensor.pin_memory() for tensor in batch]
+        return batch
@@ -0,0 +1,94 @@
+# coding=utf-8
+
+import torch
+
+class ConfusionMatrix(object):
+    """ Accumulates the confusion matrix of a multiclass classifier batch by
+        batch on the device of the predictions, so the labels and predictions
+        never have to be copied to the CPU or kept around. The macro-level
+        metrics are derived from the counts at the end, matching the macro
+        averages of sklearn.metrics over the classes that appear in either
+        the labels or the predictions.
+    """
+
+    def __init__(self):
+        """ Initializes an empty ConfusionMatrix. Its number of classes and
+            device are taken from the first batch.
+
+            Returns:
+                None
+        """
+        self.counts = None # shape (num_classes, num_classes), rows are labels
+
+    def update(self, scores, labels):
+        """ Adds a batch of predictions to the confusion matrix.
+
+            Args:
+                scores: torch.Tensor of shape (batch_size, num_classes)
+                    The scores of each class for each example.
+                labels: torch.LongTensor of shape (batch_size,)
+                    The true class of each example.
+
+            Returns:
+                preds: torch.LongTensor of shape (batch_size,)
+                    The predicted class of each example.
+        """
+        num_classes = scores.shape[1]
+        if self.counts is None:
+            self.counts = torch.zeros(
+                (num_classes, num_classes), dtype=torch.long, device=scores.device)
+        preds = torch.argmax(scores.detach(), dim=1)
+        cells = labels.long() * num_classes + preds
+        self.counts += torch.bincount(cells, minlength=num_classes ** 2).view(num_classes, num_classes)
+        return preds
+
+    def merge(self, counts):
+        """ Adds the counts of another confusion matrix, such as the one of
+            another process.
+
+            Args:
+                counts: torch.LongTensor of shape (num_classes, num_classes) or None
+                    The counts to add.
+
+            Returns:
+                None
+        """
+        if counts is None:
+            return
+        if self.counts is None:
+            self.counts = counts.clone()
+        else:
+            self.counts += counts.to(self.counts.device)
+
+    def compute(self):
+        """ Computes the accuracy and the macro-level precision, recall and
+            f1 from the counts. A metric that is undefined for a class (such
+            as the precision of a class that is never predicted) is 0 for that
+            class.
+
+            Returns:
+                results: dict of string to float
+                    The accuracy, precision, recall and f1.
+        """
+        if self.counts is None:
+            return {"accuracy": 0.0, "precision": 0.0, "recall": 0.0, "f1": 0.0}
+
+        # Only a num_classes x num_classes matrix is copied off the device
+        counts = self.counts.double().cpu()
+        true_positives = torch.diagonal(counts)
+        actual = counts.sum(dim=1)
+        predicted = counts.sum(dim=0)
+        present = (actual + predicted) > 0
+
+        def ratio(numerator, denominator):
+            return torch.where(denominator > 0, numerator / denominator.clamp(min=1), torch.zeros_like(numerator))
+
+        precision = ratio(true_positives, predicted)[present]
+        recall = ratio(true_positives, actual)[present]
+        f1 = ratio(2 * true_positives, actual + predicted)[present]
+        return {
+            "accuracy": (true_positives.sum() / counts.sum()).item(),
+            "precision": precision.mean().item(),
+            "recall": recall.mean().item(),
+            "f1": f1.mean().item()
+        }
@@ -1,17 +1,27 @@
 # coding=utf-8
 
-import copy
+import concurrent.futures
 import os
 import torch
 from collections import defaultdict
-from sklearn.metrics import accuracy_score
-from sklearn.metrics import f1_score
-from sklearn.metrics import precision_score
-from sklearn.metrics import recall_score
 from string import Template
+from torch.func import functional_call
+from torch.utils.data import BatchSampler
 from torch.utils.data import DataLoader
+from torch.utils.data import RandomSampler
+from torch.utils.data import SequentialSampler
 
+import trainer.distributed
 import trainer.utils
+from trainer.checkpoints import CheckpointWriter
+from trainer.distributed import ShardedBatchSampler
+from trainer.distributed import get_rank
+from trainer.distributed import get_world_size
+from trainer.distributed import wrap_model
+from trainer.loaders import TensorBatchLoader
+from trainer.metrics import ConfusionMatrix
+from trainer.samplers import BucketBatchSampler
+from trainer.snapshot import ModelSnapshot
 
 PROGRESS_MSG = Template(
     "Macro-level accuracy: ${accuracy}\n"
@@ -20,6 +30,9 @@ PROGRESS_MSG = Template(
     "Macro-level f1: ${f1}"
 )
 
+# Position of the question lengths in datasets of (features, lengths, labels)
+LENGTHS_INDEX = 1
+
 class MulticlassClassifierTrainer(object):
     """ This class defines an API for training and evaluating Multiclass
         Classifiers built using PyTorch. """
@@ -38,6 +51,8 @@ class MulticlassClassifierTrainer(object):
                     Controls how often to log training and validation results.
                 num_workers: int
                     Controls how many worker processes to use for training.
+                    Only used for datasets that are not resident tensors
+                    (see prefetch_batches).
                 checkpoint_dir: string
                     Specifies the directory where checkpoint files and plots
                     will be saved.
@@ -50,6 +65,50 @@ class MulticlassClassifierTrainer(object):
                     GPU, use "cuda:<num>". For example, on a computer with 2
                     GPUs, use "cuda:0" to train on the first GPU and "cuda:1"
                     to train on the second GPU.
+                bucket_size: int
+                    Optional, the number of training batches to sort by length
+                    together so that each batch can be trimmed to its longest
+                    example. Bucketing requires resident tensor datasets of
+                    (features, lengths, labels), whose lengths (at
+                    LENGTHS_INDEX) are the true lengths of both questions of
+                    each pair, and is turned off when this is 0 (the default).
+                shuffle: bool
+                    Optional, specifies whether to visit the training examples
+                    in a random order, which for bucketing means shuffling the
+                    examples before bucketing and the batches after. Defaults
+                    to False.
+                prefetch_batches: int
+                    Optional, the number of batches that threads gather ahead
+                    of time for datasets of resident tensors (such as a
+                    TensorDataset), which are batched with a TensorBatchLoader
+                    instead of a DataLoader. Defaults to 2, and 0 gathers each
+                    batch when it is needed.
+                pin_memory: bool
+                    Optional, specifies whether to gather the batches into
+                    page-locked memory so that they are copied to the GPU
+                    asynchronously. Defaults to False.
+                checkpoint_frozen: bool
+                    Optional, specifies whether checkpoints include the frozen
+                    state of the model, such as the embedding matrix, which
+                    abcnn_model_loader does not load. Defaults to False.
+                seed: int
+                    Optional, the seed that the processes of a data-parallel
+                    run shuffle the training set with, together with the
+                    epoch number. Defaults to 0.
+
+            The datasets can contain (features, labels) or (features, lengths,
+            labels). Every tensor except the labels is passed to the model.
+
+            If the process is part of a torch.distributed process group (see
+            trainer.distributed.init_distributed), then training is data-
+            parallel: every process trains a DistributedDataParallel copy of
+            the model (see trainer.distributed.wrap_model) on its shard of
+            the batches, which all-reduces the gradients. To keep the processes in step, some of them train on
+            one repeated batch when the number of batches is not a multiple of
+            the number of processes, but repeated batches are left out of the
+            metrics. Evaluation is sharded as well, and the metrics of every
+            process are combined, so every process sees the same results.
+            Only the process of rank 0 logs and saves checkpoints.
 
             Args:
                 config: dict
@@ -58,12 +117,21 @@ class MulticlassClassifierTrainer(object):
             Returns:
                 None
         """
-        # Keep track of current model and best model
-        self._best_model = None
+        # Keep track of current model and a snapshot of the best model
+        self._best_snapshot = None
         self._model = None
         self._history = None
+        self._prefetcher = None
+        self.bucket_size = 0
+        self.shuffle = False
+        self.prefetch_batches = 2
+        self.pin_memory = False
+        self.checkpoint_frozen = False
+        self.seed = 0
+        self._epoch = 0
 
         # Hacky way to get tqdm to work in the shell and in jupyter
+        global tqdm, trange
         if config["environment"] == "script":
             from tqdm import tqdm
             from tqdm import trange
@@ -112,27 +180,35 @@ class MulticlassClassifierTrainer(object):
             Returns:
                 None
         """
-        # Setup
+        # Setup. Wrapping the model for data-parallel training copies the
+        # state of rank 0 to every process, so it comes before the snapshot.
         self._loss_fn = loss_fn
         self._model = model
-        self._best_model = copy.deepcopy(model)
+        self._train_model = model
+        if get_world_size() > 1:
+            self._train_model = wrap_model(model)
+        self._best_snapshot = ModelSnapshot(model)
         self._optimizer = optimizer
         self._scheduler = scheduler
+        self._checkpoint_writer = CheckpointWriter(include_frozen=self.checkpoint_frozen)
 
         # Training loop
+        verbose = self.verbose and self._is_main_process()
         self._best_f1 = 0
         self._history = defaultdict(list)
-        for epoch in trange(self.num_epochs, desc="epochs", position=0):
+        val_results = None
+        for epoch in trange(self.num_epochs, desc="epochs", position=0, disable=not self._is_main_process()):
+            self._epoch = epoch
 
             # Process training set
             train_results, _ = self._process(trainset, False, True, desc="train")
-            if self.verbose:
+            if verbose:
                 tqdm.write(PROGRESS_MSG.substitute(train_results))
 
             # Process validation set, if provided
             if valset:
                 val_results, _ = self._process(valset, False, False, desc="val")
-                if self.verbose:
+                if verbose:
                     tqdm.write(PROGRESS_MSG.substitute(val_results))
 
             # Take step for LR scheduler
@@ -154,13 +230,16 @@ class MulticlassClassifierTrainer(object):
         
             # Save checkpoint and plots
             if self.log_every != 0 and epoch % self.log_every == 0:
-                if self.verbose:
+                if verbose:
                     tqdm.write("Saving checkpoint...")
                 filename = "checkpoint_epoch_{}".format(epoch)
                 filepath = os.path.join(self.checkpoint_dir, filename)
                 self._save_checkpoint(filepath)
                 # self._save_plots()
 
+        # Wait for the last checkpoint to be written
+        self._checkpoint_writer.close()
+
     def predict(self, dataset):
         """ Processes the examples in the dataset for evaluation and
             prediction.
@@ -176,13 +255,14 @@ class MulticlassClassifierTrainer(object):
                 predicted: list of int
                     Contains the predictions of the examples in the dataset.
         """
-        return self._process(dataset, True, False, desc="predicting")
+        return self._process(dataset, True, False, desc="predicting", keep_preds=True)
 
     def _process(self, 
                  dataset, 
                  use_best,
                  is_training,
-                 desc=None):
+                 desc=None,
+                 keep_preds=False):
         """ Processes the examples in the dataset.
 
             Args:
@@ -192,7 +272,9 @@ class MulticlassClassifierTrainer(object):
                     Specifies whether to use the current or best model
                     for processing examples. The best model should be used
                     for evaluation or prediction, and the current model
-                    should be used for training and validation.
+                    should be used for training and validation. The best
+                    model is the current model run with the state of the best
+                    snapshot, which leaves the current model unchanged.
                 is_training: bool
                     Specifies whether or not to update model weights.
                     Model weights should only be updated during training.
@@ -201,44 +283,60 @@ class MulticlassClassifierTrainer(object):
                 desc: string
                     Optional, write a short description at the front
                     of the progress bar.
+                keep_preds: bool
+                    Specifies whether to return the predictions. The metrics
+                    are accumulated on the device either way, so the
+                    predictions are only collected when they are needed.
 
             Returns:
                 results: dict
                     Contains evaluation metrics for the model on the given
                     dataset.
-                preds: list of int
-                    Contains the predictions of the examples in the dataset.
+                preds: list of int or None
+                    Contains the predictions of the examples in the dataset,
+                    if keep_preds is set.
         """
         # Get the appropriate model for processing
-        model = self._best_model if use_best else self._model
-        model = model.train() if is_training else model.eval()
+        model = self._model.train() if is_training else self._model.eval()
+        if is_training:
+            model = self._train_model
+        snapshot = self._best_snapshot if use_best else None
+        best_state = None
 
         # Process batches
-        actual = []
-        predicted = []
-        total_loss = 0
-        dataloader = \
-            DataLoader(
-                dataset,
-                batch_size=self.batch_size,
-                num_workers=self.num_workers
-            )
-        for features, labels in tqdm(dataloader, desc=desc, position=1):
+        confusion = ConfusionMatrix()
+        predicted = [] if keep_preds else None
+        total_loss = 0.0
+        dataloader = self._make_loader(dataset, is_training)
+        num_real_batches = len(dataloader)
+        if isinstance(dataloader.batch_sampler, ShardedBatchSampler):
+            num_real_batches = dataloader.batch_sampler.num_real_batches()
+        batches = tqdm(dataloader, desc=desc, position=1, disable=not self._is_main_process())
+        for batch_num, batch in enumerate(batches):
+            is_padding = batch_num >= num_real_batches
             
             # Load tensors to correct device
-            features, labels = self._move_to_device(features, labels)
+            *inputs, labels = self._move_to_device(*batch)
 
             # Forward pass
-            scores = self._model(features)
-            preds = torch.argmax(scores, dim=1)
-
-            # Store actual and predicted labels
-            actual.extend(labels.cpu().tolist())
-            predicted.extend(preds.cpu().tolist())
-
-            # Update loss
+            if snapshot is None:
+                scores = model(*inputs)
+            else:
+                if best_state is None:
+                    best_state = snapshot.on_device(labels.device)
+                scores = functional_call(model, best_state, tuple(inputs))
+
+            # Count actual and predicted labels on the device. Batches that
+            # are repeated to pad a data-parallel shard are only trained on.
+            if not is_padding:
+                preds = confusion.update(scores, labels)
+                if keep_preds:
+                    predicted.append(preds)
+
+            # Update loss without keeping the batch's graph alive
             batch_loss = torch.sum(self._loss_fn(scores, labels))
-            total_loss += batch_loss
+            if not is_padding:
+                total_loss += batch_loss.detach()
 
             # Backward pass
             if is_training:
@@ -246,24 +344,103 @@ class MulticlassClassifierTrainer(object):
                 batch_loss.backward()
                 self._optimizer.step()
 
-        # Compute evaluation metrics
-        avg_loss = total_loss / len(dataset)
-        accuracy = accuracy_score(actual, predicted)
-        precision = precision_score(actual, predicted, average="macro")
-        recall = recall_score(actual, predicted, average="macro")
-        f1 = f1_score(actual, predicted, average="macro")
+        # Synchronize with the device only here
+        total_loss = float(total_loss)
+        if keep_preds:
+            predicted = torch.cat(predicted).cpu().tolist() if predicted else []
+
+        # Combine the shards of every process, in the order of their ranks
+        if get_world_size() > 1:
+            counts = None if confusion.counts is None else confusion.counts.cpu()
+            shards = trainer.distributed.all_gather((counts, total_loss, predicted))
+            confusion = ConfusionMatrix()
+            for counts, _, _ in shards:
+                confusion.merge(counts)
+            total_loss = sum(shard_loss for _, shard_loss, _ in shards)
+            if keep_preds:
+                predicted = [pred for _, _, shard_preds in shards for pred in shard_preds]
 
-        # Return results
+        # Compute evaluation metrics
         results = {
             "total_loss": total_loss,
-            "avg_loss": avg_loss,
-            "accuracy": accuracy,
-            "precision": precision,
-            "recall": recall,
-            "f1": f1
+            "avg_loss": total_loss / len(dataset),
+            **confusion.compute()
         }
         return results, predicted
 
+    def _make_loader(self, dataset, is_training):
+        """ Creates the iterator over the batches of a dataset. Datasets of
+            resident tensors are batched with a TensorBatchLoader, whose
+            prefetch threads are shared by every epoch and dataset, and any
+            other dataset with a DataLoader.
+
+            Args:
+                dataset: Dataset
+                    Contains the examples and their labels.
+                is_training: bool
+                    Specifies whether the batches are used for training, which
+                    is when they are bucketed and shuffled.
+
+            Returns:
+                loader: TensorBatchLoader or DataLoader
+                    Yields the batches as lists of tensors.
+
+            Raises:
+                ValueError
+        """
+        shuffle = is_training and self.shuffle
+        world_size = get_world_size()
+        generator = None
+        if world_size > 1:
+            # Every process must draw the same batches before sharding them
+            generator = torch.Generator()
+            generator.manual_seed(self.seed + self._epoch)
+
+        batch_sampler = None
+        if is_training and self.bucket_size:
+            if len(getattr(dataset, "tensors", ())) != 3:
+                raise ValueError("Bucketing requires a tensor dataset of (features, lengths, labels)")
+            lengths = torch.max(dataset.tensors[LENGTHS_INDEX], dim=1)[0]
+            batch_sampler = BucketBatchSampler(
+                lengths, self.batch_size, self.bucket_size, shuffle=shuffle, generator=generator)
+        if world_size > 1:
+            if batch_sampler is None:
+                sampler = RandomSampler(dataset, generator=generator) if shuffle else SequentialSampler(dataset)
+                batch_sampler = BatchSampler(sampler, self.batch_size, drop_last=False)
+
+            # Training batches are padded to keep the gradient all-reduces in step
+            batch_sampler = ShardedBatchSampler(batch_sampler, get_rank(), world_size, pad=is_training)
+
+        if hasattr(dataset, "tensors"):
+            if self._prefetcher is None and self.prefetch_batches > 0:
+                self._prefetcher = concurrent.futures.ThreadPoolExecutor(self.prefetch_batches)
+            return \
+                TensorBatchLoader(
+                    dataset.tensors,
+                    self.batch_size,
+                    batch_sampler=batch_sampler,
+                    shuffle=shuffle,
+                    pin_memory=self.pin_memory,
+                    executor=self._prefetcher,
+                    prefetch=self.prefetch_batches
+                )
+        if batch_sampler is not None:
+            return \
+                DataLoader(
+                    dataset,
+                    batch_sampler=batch_sampler,
+                    num_workers=self.num_workers,
+                    pin_memory=self.pin_memory
+                )
+        return \
+            DataLoader(
+                dataset,
+                batch_size=self.batch_size,
+                shuffle=shuffle,
+                num_workers=self.num_workers,
+                pin_memory=self.pin_memory
+            )
+
     def _move_to_device(self, *tensors):
         """ Moves the given modules / tensors to the appropriate device.
 
@@ -281,7 +458,7 @@ class MulticlassClassifierTrainer(object):
                 tensors: list of tensors / modules
                     Contains the tensors / modules moved to the proper device.
         """
-        return trainer.utils.move_to_device(self.device, *tensors)
+        return trainer.utils.move_to_device(self.device, *tensors, non_blocking=self.pin_memory)
 
     def _update_best_model(self, results):
         """ Helper function to update the best model observed.
@@ -295,20 +472,21 @@ class MulticlassClassifierTrainer(object):
                 None
         """
         if results["f1"] > self._best_f1:
-            if self.verbose:
+            if self.verbose and self._is_main_process():
                 tqdm.write("New best checkpoint!")
-            self._best_model = copy.deepcopy(self._model)
+            self._best_snapshot.capture()
             self._best_f1 = results["f1"]
             filepath = os.path.join(self.checkpoint_dir, "best_checkpoint")
             self._save_checkpoint(filepath)
 
     def _save_checkpoint(self, filepath):
-        """ Saves a checkpoint of the model at the given filepath.
+        """ Saves a checkpoint of the model at the given filepath on a
+            background thread, without blocking training on the disk.
 
             The checkpoint saves the following information to a file:
 
-                - the current state of the model
-                 the current state of the optimizer
+                - the current trainable state of the model
+                - the current state of the optimizer
                 - the current history of the model
             
             Args:
@@ -318,12 +496,23 @@ class MulticlassClassifierTrainer(object):
             Returns:
                 None
         """
-        trainer.utils.save_checkpoint(
-            self._model, 
-            self._optimizer, 
-            self._history, 
-            filepath
-        )
+        if self._is_main_process():
+            self._checkpoint_writer.save(
+                self._model, 
+                self._optimizer, 
+                self._history, 
+                filepath
+            )
+
+    def _is_main_process(self):
+        """ Checks whether this process logs and saves checkpoints, which is
+            only the process of rank 0 in data-parallel training.
+
+            Returns:
+                is_main: bool
+                    True if this process has rank 0.
+        """
+        return get_rank() == 0
 
     def _save_plots(self):
         """ Saves plots of the model's metric history.
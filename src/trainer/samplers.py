@@ -0,0 +1,60 @@
+# coding=utf-8
+
+import torch
+from torch.utils.data import Sampler
+
+class BucketBatchSampler(Sampler):
+    """ Groups examples of similar length into the same batch so that each
+        batch can be trimmed to its longest member with little padding left.
+
+        The examples are split into buckets of bucket_size consecutive batches.
+        Each bucket is sorted by length and cut into batches, and the order of
+        the batches is shuffled across all buckets.
+    """
+
+    def __init__(self, lengths, batch_size, bucket_size=100, shuffle=True, generator=None):
+        """ Initializes the BucketBatchSampler.
+
+            Args:
+                lengths: torch.LongTensor of shape (num_examples,)
+                    The length of each example.
+                batch_size: int
+                    The number of examples per batch.
+                bucket_size: int
+                    The number of batches that are sorted by length together.
+                shuffle: bool
+                    Specifies whether to shuffle the examples before bucketing
+                    and the batches after bucketing.
+                generator: torch.Generator
+                    Optional, the random number generator to shuffle with.
+                    If None, then the global generator is used.
+
+            Returns:
+                None
+        """
+        self.lengths = lengths
+        self.batch_size = batch_size
+        self.bucket_size = bucket_size
+        self.shuffle = shuffle
+        self.generator = generator
+
+    def __iter__(self):
+        num_examples = len(self.lengths)
+        if self.shuffle:
+            indices = torch.randperm(num_examples, generator=self.generator)
+        else:
+            indices = torch.arange(num_examples)
+
+        # Sort each bucket by length and cut it into batches
+        batches = []
+        for bucket in torch.split(indices, self.batch_size * self.bucket_size):
+            order = torch.sort(self.lengths[bucket])[1]
+            batches.extend(torch.split(bucket[order], self.batch_size))
+
+        # Shuffle the batches across buckets
+        if self.shuffle:
+            batches = [batches[i] for i in torch.randperm(len(batches), generator=self.generator)]
+        return iter(batch.tolist() for batch in batches)
+
+    def __len__(self):
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
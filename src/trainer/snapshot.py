@@ -0,0 +1,110 @@
+# coding=utf-8
+
+import torch
+
+def trainable_state(model):
+    """ Finds the state of a model that training can change: every parameter
+        that requires gradients and the buffers of the modules that own such
+        parameters. Frozen parameters (such as the embedding matrix) and the
+        buffers of modules without trainable parameters are assumed not to
+        change.
+
+        Args:
+            model: nn.Module
+                The model to inspect.
+
+        Returns:
+            tensors: dict of string to torch.Tensor
+                Maps the name of each tensor to the tensor itself. A tensor
+                shared by several modules appears only once.
+    """
+    tensors = {}
+    seen = set()
+    for module_name, module in model.named_modules():
+        params = list(module.named_parameters(recurse=False))
+        if not any(param.requires_grad for _, param in params):
+            continue
+        prefix = module_name + "." if module_name else ""
+        named_tensors = [(name, param) for name, param in params if param.requires_grad]
+        named_tensors += list(module.named_buffers(recurse=False))
+        for name, tensor in named_tensors:
+            if id(tensor) not in seen:
+                seen.add(id(tensor))
+                tensors[prefix + name] = tensor
+    return tensors
+
+
+def trainable_state_dict(model):
+    """ Filters the state_dict of a model down to its trainable state (see
+        trainable_state), keeping every name of a shared tensor so that the
+        result can be loaded back into the model's full state_dict.
+
+        Args:
+            model: nn.Module
+                The model to inspect.
+
+        Returns:
+            state_dict: dict of string to torch.Tensor
+                The entries of the model's state_dict that belong to its
+                trainable state, detached but not copied.
+    """
+    trainable = {id(tensor) for tensor in trainable_state(model).values()}
+    return {
+        name: tensor.detach()
+        for name, tensor in model.state_dict(keep_vars=True).items()
+        if id(tensor) in trainable
+    }
+
+
+class ModelSnapshot(object):
+    """ Keeps a copy of the state of a model that training can change (see
+        trainable_state) on the CPU. Frozen state, such as the embedding
+        matrix, is neither copied nor stored.
+
+        The storage is allocated once, and every capture overwrites it in
+        place, so taking a snapshot never allocates memory.
+    """
+
+    def __init__(self, model):
+        """ Allocates the storage for the snapshot and captures the current
+            state of the model.
+
+            Args:
+                model: nn.Module
+                    The model to take snapshots of.
+
+            Returns:
+                None
+        """
+        self.tensors = trainable_state(model)
+        self.storage = {
+            name: torch.empty(tensor.shape, dtype=tensor.dtype, device="cpu")
+            for name, tensor in self.tensors.items()
+        }
+        self.capture()
+
+    def capture(self):
+        """ Overwrites the snapshot with the current state of the model.
+
+            Returns:
+                None
+        """
+        with torch.no_grad():
+            for name, tensor in self.tensors.items():
+                self.storage[name].copy_(tensor)
+
+    def on_device(self, device):
+        """ Copies the snapshot to a device, to be passed to
+            torch.func.functional_call along with the model.
+
+            Args:
+                device: torch.device
+                    The device of the model.
+
+            Returns:
+                state: dict of string to torch.Tensor
+                    The snapshot on the device. Tensors on the CPU are not
+                    copied.
+        """
+        return {name: tensor.to(device) for name, tensor in self.storage.items()}
+
@@ -7,7 +7,10 @@ import numpy as np
 import matplotlib.pyplot as plt
 plt.switch_backend("agg")  
 
-def move_to_device(device, *tensors):
+from trainer.checkpoints import checkpoint_state
+from trainer.checkpoints import write_checkpoint
+
+def move_to_device(device, *tensors, non_blocking=False):
     """ Moves the given modules / tensors to the appropriate device.
 
         If a device was specified in the training configuration, then
@@ -19,6 +22,9 @@ def move_to_device(device, *tensors):
         Args:
             tensors: list of tensors / modules
                 Contains the tensors / modules we would like to move.
+            non_blocking: bool
+                Specifies whether to copy tensors in page-locked memory to
+                the GPU asynchronously.
                
         Returns:
             tensors: list of tensors / modules
@@ -29,18 +35,19 @@ def move_to_device(device, *tensors):
     if device:
         if "cuda" in device:
             torch.cuda.empty_cache()
-        tensors = list(map(lambda t: t.to(device=device), tensors))
+        tensors = list(map(lambda t: t.to(device=device, non_blocking=non_blocking), tensors))
     elif torch.cuda.is_available():
         torch.cuda.empty_cache()
-        tensors = list(map(lambda t: t.cuda(), tensors))
+        tensors = list(map(lambda t: t.to(device="cuda", non_blocking=non_blocking), tensors))
     else:
         tensors = list(map(lambda t: t.cpu(), tensors))
 
     return tensors[0] if len(tensors) == 1 else tensors
 
-def save_checkpoint(model, optimizer, history, filepath):
+def save_checkpoint(model, optimizer, history, filepath, include_frozen=False):
     """ Saves the state of the model to a pickle file so that it can continue 
-        to be trained at a later time.
+        to be trained at a later time. The file is replaced atomically. See
+        trainer.checkpoints.CheckpointWriter to save without blocking.
 
         Args:
             model: torch.nn.Module 
@@ -51,18 +58,17 @@ def save_checkpoint(model, optimizer, history, filepath):
                 Contains histories of desired run metrics.
             filepath
                 The path where the checkpoint file will be saved.
+            include_frozen: bool
+                Specifies whether to save the frozen state of the model, such
+                as the embedding matrix.
         
         Returns:
             None
     """
     # Move everything to CPU so model can be loaded into CPU or
     # GPU next time
-    state = (
-        model.state_dict(),
-        optimizer.state_dict(),
-        history,
-    )
-    torch.save(state, filepath)
+    state = checkpoint_state(model, optimizer, history, include_frozen=include_frozen)
+    write_checkpoint(state, filepath)
 
 
 def load_checkpoint(filepath, map_location=None):
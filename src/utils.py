@@ -26,12 +26,12 @@ def abcnn_model_loader(filepath, model, optimizer):
                 The optimizer used to train the ABCNN model.
     """
     state = load_checkpoint(filepath)
-    new_model_dict, new_optim_dict, _, _ = state
+    new_model_dict, new_optim_dict = state[0], state[1]
     
     # Overwrite the model state
     new_model_dict = {
         k: v for k, v in new_model_dict.items()
-        if k != "embeddings.weight" # ignore embedding layer
+        if not k.startswith("embeddings.") # ignore embedding layer, even if quantized
     }
     model_dict = model.state_dict()
     model_dict.update(new_model_dict)
@@ -43,6 +43,63 @@ def abcnn_model_loader(filepath, model, optimizer):
     return model, optimizer
 
 
+def autocast_inference(model, inputs, lengths=None, dtype=torch.bfloat16):
+    """ Computes the scores of an fp32 ABCNN model for a batch of question
+        pairs on the CPU, running the model's operations in reduced precision
+        via autocasting.
+
+        Args:
+            model: ABCNN model
+                An instance of the ABCNN model whose weights are on the CPU.
+            inputs: torch.LongTensor of shape (batch_size, 2, max_length)
+                The tokenized inputs for a batch of question pairs.
+            lengths: torch.LongTensor of shape (batch_size, 2)
+                Optional, the true lengths of the questions in each pair.
+            dtype: torch.dtype
+                The reduced-precision dtype to autocast to.
+
+        Returns:
+            scores: torch.FloatTensor of shape (batch_size, 2)
+                The scores for each class for each pair of questions.
+    """
+    model.eval()
+    with torch.no_grad(), torch.autocast("cpu", dtype=dtype):
+        scores = model(inputs, lengths)
+    return scores.float()
+
+
+def validate_autocast_inference(model, inputs, lengths=None, dtype=torch.bfloat16):
+    """ Compares the scores of an ABCNN model computed with autocast_inference
+        against its fp32 scores.
+
+        Args:
+            model: ABCNN model
+                An instance of the ABCNN model whose weights are on the CPU.
+            inputs: torch.LongTensor of shape (batch_size, 2, max_length)
+                The tokenized inputs for a batch of question pairs.
+            lengths: torch.LongTensor of shape (batch_size, 2)
+                Optional, the true lengths of the questions in each pair.
+            dtype: torch.dtype
+                The reduced-precision dtype to autocast to.
+
+        Returns:
+            max_error: float
+                The largest absolute difference between the two sets of scores.
+            agreement: float
+                The fraction of question pairs for which both sets of scores
+                predict the same class.
+    """
+    model.eval()
+    with torch.no_grad():
+        expected = model(inputs, lengths)
+    actual = autocast_inference(model, inputs, lengths, dtype=dtype)
+    max_error = torch.max(torch.abs(actual - expected)).item()
+    agreement = torch.mean(
+        (torch.argmax(actual, dim=1) == torch.argmax(expected, dim=1)).float()
+    ).item()
+    return max_error, agreement
+
+
 def freeze_weights(pretrained_model):
     """ Creates a copy of the pre-trained model with its conv-pool layer
         weights frozen. This allow us to learn only the weights in the